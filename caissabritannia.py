@@ -1,29 +1,23 @@
-from unorthodox import (BLACK, Bishop, CannonRider, King, Queen, Rider, WHITE,
-                        black_knight, black_rook, play, white_knight,
-                        white_rook)
+from unorthodox import (BLACK, Bishop, CannonRider, King, Move, Queen, Rider,
+                        WHITE, black_knight, black_rook, empty, index, play,
+                        white_knight, white_rook)
 from grandchess import GrandChessPawn, GrandChessPosition
 
 
 class CaissaBritanniaQueen(Queen):
     def generate_moves(self, position, origin):
         moves = []
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            while position.empty(target):
-                if position.attacked(target, -self.player):
+        board = position.board
+        attacks = position.attack_map(-self.player)
+        for ray in position.rays(self.steps)[origin]:
+            for target in ray:
+                if board[target] is not empty:
+                    if position.capturable(target):
+                        moves.append(Move(origin, target))
                     break
-                move = position.make_move(origin, target)
-                moves.append(move)
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
-            if position.capturable(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
+                if attacks[target]:
+                    break
+                moves.append(Move(origin, target))
         return moves
 
 
@@ -32,18 +26,13 @@ class CaissaBritanniaKing(King):
 
     def generate_moves(self, position, origin):
         moves = King.generate_moves(self, position, origin)
-        for offset in self.offsets:
-            target = (
-                origin[0] + 2 * self.player * offset[0],
-                origin[1] + 2 * offset[1]
-            )
-            while position.empty(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
+        # slides, jumping over the adjacent square
+        board = position.board
+        for ray in position.rays(self.steps)[origin]:
+            for target in ray[1:]:
+                if board[target] is not empty:
+                    break
+                moves.append(Move(origin, target))
         return moves
 
 
@@ -75,16 +64,16 @@ class CaissaBritanniaBishop(Bishop):
     value = 470
     non_capture_offsets = (-1, 0), (0, -1), (0, 1), (1, 0)
 
+    def __init__(self, player, symbol):
+        Bishop.__init__(self, player, symbol)
+        self.non_capture_steps = self.deltas(self.non_capture_offsets)
+
     def generate_moves(self, position, origin):
         moves = Bishop.generate_moves(self, position, origin)
-        for offset in self.non_capture_offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            if position.empty(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
+        board = position.board
+        for target in position.leaps(self.non_capture_steps)[origin]:
+            if board[target] is empty:
+                moves.append(Move(origin, target))
         return moves
 
 
@@ -180,9 +169,9 @@ position[9, 6] = white_bishop
 position[9, 7] = white_unicorn
 position[9, 8] = white_rook
 position[9, 9] = white_dragon
-position.royal[WHITE] = 9, 4
-position.royal[BLACK] = 0, 4
+position.royal[WHITE] = index(9, 4)
+position.royal[BLACK] = index(0, 4)
 if __name__ == "__main__":
     print("Caïssa Britannia by Fergus Duniho")
     print("Rules: https://www.chessvariants.com/large.dir/british.html")
-    play(position, 10)
+    play(position, 10, book="caissabritannia.book")
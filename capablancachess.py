@@ -1,7 +1,8 @@
-from unorthodox import (BLACK, DoubleStepPawn, EnPassantPosition, LeaperRider,
-                        WHITE, black_bishop, black_king, black_knight,
-                        black_queen, black_rook, empty, play, white_bishop,
-                        white_king, white_knight, white_queen, white_rook)
+from unorthodox import (BLACK, CastlingPosition, DoubleStepPawn,
+                        EnPassantPosition, LeaperRider, WHITE, black_bishop,
+                        black_king, black_knight, black_queen, black_rook,
+                        index, play, white_bishop, white_king, white_knight,
+                        white_queen, white_rook, zobrist)
 
 
 class Chancellor(LeaperRider):
@@ -22,87 +23,60 @@ class Archbishop(LeaperRider):
     )
 
 
-class CapablancaPosition(EnPassantPosition):
+class CapablancaPosition(CastlingPosition, EnPassantPosition):
     """An 8x10 position with support for Capablanca castling."""
+    # castling rights lost by moving from or to a square
+    castling_squares = {
+        index(7, 5): (0, 1), index(7, 9): (0,), index(7, 0): (1,),
+        index(0, 5): (2, 3), index(0, 9): (2,), index(0, 0): (3,),
+    }
+    castling_keys = zobrist("castling", 4)
+    castling_moves = (
+        (index(7, 5), index(7, 8), index(7, 9), index(7, 7)),
+        (index(7, 5), index(7, 2), index(7, 0), index(7, 3)),
+        (index(0, 5), index(0, 8), index(0, 9), index(0, 7)),
+        (index(0, 5), index(0, 2), index(0, 0), index(0, 3)),
+    )
 
     def __init__(self, **kwargs):
         if "copy" in kwargs:
-            copy = kwargs["copy"]
-            EnPassantPosition.__init__(self, **kwargs)
-            self.castling = list(copy.castling)  # copy castling rights
+            CastlingPosition.__init__(self, **kwargs)
         else:
-            EnPassantPosition.__init__(self, size=(8, 10))
-            self.castling = [False, False, False, False]
+            CastlingPosition.__init__(self, size=(8, 10))
 
     def black_kingside_castling(self):
         """Return True if black kingside castling is possible."""
-        return (self.castling[2] and self.empty((0, 6)) and self.empty((0, 7))
-                and self.empty((0, 8)) and not self.attacked((0, 5), WHITE)
-                and not self.attacked((0, 6), WHITE) and not
-                self.attacked((0, 7), WHITE))
+        return (self.castling[2] and self.empty(index(0, 6))
+                and self.empty(index(0, 7)) and self.empty(index(0, 8))
+                and not self.attack_map(WHITE)[index(0, 5)]
+                and not self.attack_map(WHITE)[index(0, 6)]
+                and not self.attack_map(WHITE)[index(0, 7)])
 
     def black_queenside_castling(self):
         """Return True if black queenside castling is possible."""
-        return (self.castling[3] and self.empty((0, 4)) and self.empty((0, 3))
-                and self.empty((0, 2)) and self.empty((0, 1)) and not
-                self.attacked((0, 5), WHITE) and not
-                self.attacked((0, 4), WHITE) and not
-                self.attacked((0, 3), WHITE))
-
-    def generate_moves(self):
-        moves = EnPassantPosition.generate_moves(self)
-        # castling
-        if self.player == WHITE:
-            if self.white_kingside_castling():
-                move = self.make_move((7, 5), (7, 8))
-                move[7, 7] = white_rook
-                move[7, 9] = empty
-                moves.append(move)
-            if self.white_queenside_castling():
-                move = self.make_move((7, 5), (7, 2))
-                move[7, 3] = white_rook
-                move[7, 0] = empty
-                moves.append(move)
-        else:
-            if self.black_kingside_castling():
-                move = self.make_move((0, 5), (0, 8))
-                move[0, 7] = black_rook
-                move[0, 9] = empty
-                moves.append(move)
-            if self.black_queenside_castling():
-                move = self.make_move((0, 5), (0, 2))
-                move[0, 3] = black_rook
-                move[0, 0] = empty
-                moves.append(move)
-        return moves
-
-    def make_move(self, origin, target):
-        move = EnPassantPosition.make_move(self, origin, target)
-        # update castling rights
-        if origin == (7, 5) or origin == (7, 9) or target == (7, 9):
-            move.castling[0] = False
-        if origin == (7, 5) or origin == (7, 0) or target == (7, 0):
-            move.castling[1] = False
-        if origin == (0, 5) or origin == (0, 9) or target == (0, 9):
-            move.castling[2] = False
-        if origin == (0, 5) or origin == (0, 0) or target == (0, 0):
-            move.castling[3] = False
-        return move
+        return (self.castling[3] and self.empty(index(0, 4))
+                and self.empty(index(0, 3)) and self.empty(index(0, 2))
+                and self.empty(index(0, 1))
+                and not self.attack_map(WHITE)[index(0, 5)]
+                and not self.attack_map(WHITE)[index(0, 4)]
+                and not self.attack_map(WHITE)[index(0, 3)])
 
     def white_kingside_castling(self):
         """Return True if white kingside castling is possible."""
-        return (self.castling[0] and self.empty((7, 6)) and self.empty((7, 7))
-                and self.empty((7, 8)) and not self.attacked((7, 5), BLACK)
-                and not self.attacked((7, 6), BLACK) and not
-                self.attacked((7, 7), BLACK))
+        return (self.castling[0] and self.empty(index(7, 6))
+                and self.empty(index(7, 7)) and self.empty(index(7, 8))
+                and not self.attack_map(BLACK)[index(7, 5)]
+                and not self.attack_map(BLACK)[index(7, 6)]
+                and not self.attack_map(BLACK)[index(7, 7)])
 
     def white_queenside_castling(self):
         """Return True if white queenside castling is possible."""
-        return (self.castling[1] and self.empty((7, 4)) and self.empty((7, 3))
-                and self.empty((7, 2)) and self.empty((7, 1)) and not
-                self.attacked((7, 5), BLACK) and not
-                self.attacked((7, 4), BLACK) and not
-                self.attacked((7, 3), BLACK))
+        return (self.castling[1] and self.empty(index(7, 4))
+                and self.empty(index(7, 3)) and self.empty(index(7, 2))
+                and self.empty(index(7, 1))
+                and not self.attack_map(BLACK)[index(7, 5)]
+                and not self.attack_map(BLACK)[index(7, 4)]
+                and not self.attack_map(BLACK)[index(7, 3)])
 
 
 white_chancellor = Chancellor(WHITE, "C")
@@ -156,10 +130,10 @@ position[7, 6] = white_bishop
 position[7, 7] = white_chancellor
 position[7, 8] = white_knight
 position[7, 9] = white_rook
-position.royal[WHITE] = 7, 5
-position.royal[BLACK] = 0, 5
+position.royal[WHITE] = index(7, 5)
+position.royal[BLACK] = index(0, 5)
 position.castling = [True, True, True, True]
 if __name__ == "__main__":
     print("Capablanca Chess by José Raúl Capablanca")
     print("Rules: https://www.chessvariants.com/large.dir/capablanca.html")
-    play(position, 10)
+    play(position, 10, book="capablancachess.book")
@@ -1,6 +1,6 @@
 from unorthodox import (BLACK, Bishop, King, Leaper, Position, SingleStepPawn,
-                        WHITE, black_king, black_knight, black_rook, play,
-                        white_king, white_knight, white_rook)
+                        WHITE, black_king, black_knight, black_rook, index,
+                        play, white_king, white_knight, white_rook)
 from shatranj import Elephant, Ferz
 
 
@@ -70,9 +70,9 @@ position[7, 8] = white_courier
 position[7, 9] = white_bishop
 position[7, 10] = white_knight
 position[7, 11] = white_rook
-position.royal[WHITE] = 7, 5
-position.royal[BLACK] = 0, 5
+position.royal[WHITE] = index(7, 5)
+position.royal[BLACK] = index(0, 5)
 if __name__ == "__main__":
     print("Courier Chess, inventor unknown")
     print("Rules: https://www.chessvariants.com/historic.dir/courier.html")
-    play(position, 10)
+    play(position, 10, book="courierchess.book")
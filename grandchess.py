@@ -1,7 +1,8 @@
-from unorthodox import (BLACK, DoubleStepPawn, EnPassantPosition, WHITE,
+from unorthodox import (BLACK, DoubleStepPawn, EnPassantPosition, Move, WHITE,
                         black_bishop, black_king, black_knight, black_queen,
-                        black_rook, empty, play, white_bishop, white_king,
-                        white_knight, white_queen, white_rook)
+                        black_rook, coordinates, index, play, white_bishop,
+                        white_king, white_knight, white_queen, white_rook,
+                        zobrist)
 from capablancachess import Chancellor, Archbishop
 
 
@@ -12,65 +13,48 @@ class GrandChessPawn(DoubleStepPawn):
         DoubleStepPawn.__init__(self, player, symbol, None, initial_rank)
 
     def can_promote(self, position, target):
-        return (self.player == WHITE and target[0] <= 2 or self.player == BLACK
-                and target[0] >= 7)
+        rank = coordinates(target)[0]
+        return (self.player == WHITE and rank <= 2 or self.player == BLACK
+                and rank >= 7)
 
     def generate_moves(self, position, origin):
         moves = []
         # captures
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
+        for step in self.steps:
+            target = origin + step
             if position.capturable(target):
                 # promotions
                 if self.can_promote(position, target):
                     moves += self.generate_promotions(position, origin, target)
                 # non-promotions
                 if not self.must_promote(position, target):
-                    move = position.make_move(origin, target)
+                    move = Move(origin, target)
                     moves.append(move)
         # non captures
-        target = (
-            origin[0] - self.player,
-            origin[1]
-        )
+        target = origin + self.forward
         if position.empty(target):
             # promotions
             if self.can_promote(position, target):
                 moves += self.generate_promotions(position, origin, target)
             # non-promotions
             if not self.must_promote(position, target):
-                moves.append(position.make_move(origin, target))
+                moves.append(Move(origin, target))
         # en passant
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
+        for step in self.steps:
+            target = origin + step
             if target == position.en_passant:
-                move = position.make_move(origin, target)
-                # coordinates of the captured pawn
-                square = (
-                    target[0] + self.player,
-                    target[1]
-                )
-                move[square] = empty
+                move = Move(origin, target)
+                # square of the captured pawn
+                move.victim = target - self.forward
+                moves.append(move)
         # double step
-        if origin[0] == self.initial_rank:
+        if coordinates(origin)[0] == self.initial_rank:
             # the intermediate square
-            square = (
-                origin[0] - self.player,
-                origin[1]
-            )
+            square = origin + self.forward
             if position.empty(square):
-                target = (
-                    square[0] - self.player,
-                    square[1]
-                )
+                target = square + self.forward
                 if position.empty(target):
-                    move = position.make_move(origin, target)
+                    move = Move(origin, target)
                     move.en_passant = square
                     moves.append(move)
         return moves
@@ -79,16 +63,13 @@ class GrandChessPawn(DoubleStepPawn):
         moves = []
         for promotion in position.promotions[self.player]:
             if position.promotions[self.player][promotion] > 0:
-                move = position.make_move(origin, target)
-                move[target] = promotion
-                move.promotions[self.player][promotion] -= 1
-                move.notation += promotion.symbol
-                moves.append(move)
+                moves.append(Move(origin, target, promotion))
         return moves
 
     def must_promote(self, position, target):
-        return (self.player == WHITE and target[0] == 0 or self.player == BLACK
-                and target[0] == 9)
+        rank = coordinates(target)[0]
+        return (self.player == WHITE and rank == 0 or self.player == BLACK
+                and rank == 9)
 
 
 class GrandChessPosition(EnPassantPosition):
@@ -123,14 +104,42 @@ class GrandChessPosition(EnPassantPosition):
                 }
             }
 
-    def make_move(self, origin, target):
-        move = EnPassantPosition.make_move(self, origin, target)
+    def change_tally(self, piece, change):
+        """Change the tally of captured pieces of a type and update the
+        hash.
+        """
+        keys = zobrist("tally " + piece.symbol)
+        tally = self.promotions[piece.player]
+        self.hash ^= keys[tally[piece]]
+        tally[piece] += change
+        self.hash ^= keys[tally[piece]]
+
+    def do_move(self, move):
+        undo = EnPassantPosition.do_move(self, move)
         # update tally of captured pieces
-        capture = self[target]
-        if capture.player in move.promotions:
-            if capture in move.promotions[capture.player]:
-                move.promotions[capture.player][capture] += 1
-        return move
+        capture = undo.capture
+        if capture.player in self.promotions:
+            if capture in self.promotions[capture.player]:
+                self.change_tally(capture, 1)
+        # a promotion uses up a captured piece
+        if move.promotion is not None:
+            self.change_tally(move.promotion, -1)
+        return undo
+
+    def find_hash(self):
+        EnPassantPosition.find_hash(self)
+        for player in WHITE, BLACK:
+            for piece, tally in self.promotions[player].items():
+                self.hash ^= zobrist("tally " + piece.symbol)[tally]
+
+    def undo_move(self, move, undo):
+        EnPassantPosition.undo_move(self, move, undo)
+        capture = undo.capture
+        if capture.player in self.promotions:
+            if capture in self.promotions[capture.player]:
+                self.promotions[capture.player][capture] -= 1
+        if move.promotion is not None:
+            self.promotions[move.promotion.player][move.promotion] += 1
 
 
 white_marshal = Chancellor(WHITE, "M")
@@ -180,9 +189,9 @@ position[8, 7] = white_bishop
 position[8, 8] = white_knight
 position[9, 0] = white_rook
 position[9, 9] = white_rook
-position.royal[WHITE] = 8, 4
-position.royal[BLACK] = 1, 4
+position.royal[WHITE] = index(8, 4)
+position.royal[BLACK] = index(1, 4)
 if __name__ == "__main__":
     print("Grand Chess by Christian Freeling")
     print("Rules: https://www.chessvariants.com/large.dir/freeling.html")
-    play(position, 10)
+    play(position, 10, book="grandchess.book")
@@ -1,5 +1,5 @@
 from unorthodox import (BLACK, Position, SingleStepPawn, WHITE, black_king,
-                        black_knight, black_queen, black_rook, play,
+                        black_knight, black_queen, black_rook, index, play,
                         white_king, white_knight, white_queen, white_rook)
 
 
@@ -32,9 +32,9 @@ position[5, 2] = white_queen
 position[5, 3] = white_king
 position[5, 4] = white_knight
 position[5, 5] = white_rook
-position.royal[WHITE] = 5, 3
-position.royal[BLACK] = 0, 3
+position.royal[WHITE] = index(5, 3)
+position.royal[BLACK] = index(0, 3)
 if __name__ == "__main__":
     print("Los Alamos Chess by Paul Stein and Mark Wells")
     print("Rules: https://www.chessvariants.com/small.dir/losalamos.html")
-    play(position, 10)
+    play(position, 10, book="losalamoschess.book")
@@ -1,6 +1,6 @@
 from unorthodox import (BLACK, DoubleStepPawn, LeaperRider, OrthodoxPosition,
                         WHITE, black_bishop, black_king, black_knight,
-                        black_queen, black_rook, play)
+                        black_queen, black_rook, index, play)
 
 
 class Maharajah(LeaperRider):
@@ -45,10 +45,10 @@ position[1, 5] = black_pawn
 position[1, 6] = black_pawn
 position[1, 7] = black_pawn
 position[7, 4] = white_maharajah
-position.royal[WHITE] = 7, 4
-position.royal[BLACK] = 0, 4
+position.royal[WHITE] = index(7, 4)
+position.royal[BLACK] = index(0, 4)
 position.castling = [False, False, True, True]
 if __name__ == "__main__":
     print("The Maharajah and the Sepoys, inventor unknown")
     print("Rules: https://www.chessvariants.com/unequal.dir/maharaja.html")
-    play(position, 10, 3, 3)
+    play(position, 10, 3, 3, book="maharajahandthesepoys.book")
@@ -0,0 +1,20 @@
+from argparse import ArgumentParser
+from importlib import import_module
+from unorthodox import DRAW, Limits, build_book
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Build the opening book of a variant, e.g. "
+                    "orthodoxchess.book for orthodoxchess.py.")
+    parser.add_argument("variant", help="the variant's module name")
+    parser.add_argument("--plies", type=int, default=4,
+                        help="the number of plies covered (default 4)")
+    parser.add_argument("--depth", type=int, default=5,
+                        help="the search depth per position (default 5)")
+    args = parser.parse_args()
+    variant = import_module(args.variant)
+    # variants with another stalemate rule declare it next to the position
+    stalemate = getattr(variant, "stalemate", DRAW)
+    size = build_book(variant.position, args.variant + ".book", args.plies,
+                      Limits(depth=args.depth), stalemate)
+    print("%d positions in %s.book" % (size, args.variant))
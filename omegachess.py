@@ -1,8 +1,9 @@
-from unorthodox import (BLACK, Leaper, TripleStepEnPassantPosition,
-                        TripleStepPawn, WHITE, black_bishop, black_king,
-                        black_knight, black_queen, black_rook, empty, lava,
-                        play, white_bishop, white_king, white_knight,
-                        white_queen, white_rook)
+from unorthodox import (BLACK, CastlingPosition, Leaper,
+                        TripleStepEnPassantPosition, TripleStepPawn, WHITE,
+                        black_bishop, black_king, black_knight, black_queen,
+                        black_rook, coordinates, index, lava, play,
+                        white_bishop, white_king, white_knight, white_queen,
+                        white_rook, zobrist)
 
 
 class Champion(Leaper):
@@ -25,89 +26,63 @@ class Wizard(Leaper):
 
 class OmegaPawn(TripleStepPawn):
     def can_promote(self, position, square):
-        return (self.player == WHITE and square[0] == 1 or self.player == BLACK
-                and square[0] == 10)
-
+        rank = coordinates(square)[0]
+        return (self.player == WHITE and rank == 1 or self.player == BLACK
+                and rank == 10)
+
+
+class OmegaPosition(CastlingPosition, TripleStepEnPassantPosition):
+    # castling rights lost by moving from or to a square
+    castling_squares = {
+        index(10, 6): (0, 1), index(10, 9): (0,), index(10, 2): (1,),
+        index(1, 6): (2, 3), index(1, 9): (2,), index(1, 2): (3,),
+    }
+    castling_keys = zobrist("castling", 4)
+    castling_moves = (
+        (index(10, 6), index(10, 8), index(10, 9), index(10, 7)),
+        (index(10, 6), index(10, 4), index(10, 2), index(10, 5)),
+        (index(1, 6), index(1, 8), index(1, 9), index(1, 7)),
+        (index(1, 6), index(1, 4), index(1, 2), index(1, 5)),
+    )
 
-class OmegaPosition(TripleStepEnPassantPosition):
     def __init__(self, **kwargs):
         if "copy" in kwargs:
-            copy = kwargs["copy"]
-            TripleStepEnPassantPosition.__init__(self, **kwargs)
-            self.castling = list(copy.castling)  # copy castling rights
+            CastlingPosition.__init__(self, **kwargs)
         else:
-            TripleStepEnPassantPosition.__init__(self, size=(12, 12))
+            CastlingPosition.__init__(self, size=(12, 12))
             for i in range(1, 11):
                 self[0, i] = lava
                 self[i, 0] = lava
                 self[i, 11] = lava
                 self[11, i] = lava
-            self.castling = [False, False, False, False]
 
     def black_kingside_castling(self):
         """Return True if black kingside castling is possible."""
-        return (self.castling[2] and self.empty((1, 7)) and self.empty((1, 8))
-                and not self.attacked((1, 6), WHITE) and not
-                self.attacked((1, 7), WHITE))
+        return (self.castling[2] and self.empty(index(1, 7))
+                and self.empty(index(1, 8))
+                and not self.attack_map(WHITE)[index(1, 6)]
+                and not self.attack_map(WHITE)[index(1, 7)])
 
     def black_queenside_castling(self):
         """Return True if black queenside castling is possible."""
-        return (self.castling[3] and self.empty((1, 5)) and self.empty((1, 4))
-                and self.empty((1, 3)) and not self.attacked((1, 6), WHITE)
-                and not self.attacked((1, 5), WHITE))
-
-    def generate_moves(self):
-        moves = TripleStepEnPassantPosition.generate_moves(self)
-        # castling
-        if self.player == WHITE:
-            if self.white_kingside_castling():
-                move = self.make_move((10, 6), (10, 8))
-                move[10, 7] = white_rook
-                move[10, 9] = empty
-                moves.append(move)
-            if self.white_queenside_castling():
-                move = self.make_move((10, 6), (10, 4))
-                move[10, 5] = white_rook
-                move[10, 2] = empty
-                moves.append(move)
-        else:
-            if self.black_kingside_castling():
-                move = self.make_move((1, 6), (1, 8))
-                move[1, 7] = black_rook
-                move[1, 9] = empty
-                moves.append(move)
-            if self.black_queenside_castling():
-                move = self.make_move((1, 6), (1, 4))
-                move[1, 5] = black_rook
-                move[1, 2] = empty
-                moves.append(move)
-        return moves
-
-    def make_move(self, origin, target, promotion=None):
-        move = TripleStepEnPassantPosition.make_move(self, origin, target)
-        # update castling rights
-        if origin == (10, 6) or origin == (10, 9) or target == (10, 9):
-            move.castling[0] = False
-        if origin == (10, 6) or origin == (10, 2) or target == (10, 2):
-            move.castling[1] = False
-        if origin == (1, 6) or origin == (1, 9) or target == (1, 9):
-            move.castling[2] = False
-        if origin == (1, 6) or origin == (1, 2) or target == (1, 2):
-            move.castling[3] = False
-        return move
+        return (self.castling[3] and self.empty(index(1, 5))
+                and self.empty(index(1, 4)) and self.empty(index(1, 3))
+                and not self.attack_map(WHITE)[index(1, 6)]
+                and not self.attack_map(WHITE)[index(1, 5)])
 
     def white_kingside_castling(self):
         """Return True if white kingside castling is possible."""
-        return (self.castling[0] and self.empty((10, 7))
-                and self.empty((10, 8)) and not self.attacked((10, 6), BLACK)
-                and not self.attacked((10, 7), BLACK))
+        return (self.castling[0] and self.empty(index(10, 7))
+                and self.empty(index(10, 8))
+                and not self.attack_map(BLACK)[index(10, 6)]
+                and not self.attack_map(BLACK)[index(10, 7)])
 
     def white_queenside_castling(self):
         """Return True if white queenside castling is possible."""
-        return (self.castling[1] and self.empty((10, 5))
-                and self.empty((10, 4)) and self.empty((10, 3)) and not
-                self.attacked((10, 6), BLACK) and not
-                self.attacked((10, 5), BLACK))
+        return (self.castling[1] and self.empty(index(10, 5))
+                and self.empty(index(10, 4)) and self.empty(index(10, 3))
+                and not self.attack_map(BLACK)[index(10, 6)]
+                and not self.attack_map(BLACK)[index(10, 5)])
 
 
 white_champion = Champion(WHITE, "C")
@@ -165,10 +140,10 @@ position[10, 9] = white_rook
 position[10, 10] = white_champion
 position[11, 0] = white_wizard
 position[11, 11] = white_wizard
-position.royal[WHITE] = 10, 6
-position.royal[BLACK] = 1, 6
+position.royal[WHITE] = index(10, 6)
+position.royal[BLACK] = index(1, 6)
 position.castling = [True, True, True, True]
 if __name__ == "__main__":
     print("Omega Chess by Daniel MacDonald")
     print("Rules: https://www.chessvariants.com/large.dir/omega/rules.html")
-    play(position, 10)
+    play(position, 10, book="omegachess.book")
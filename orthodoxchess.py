@@ -1,6 +1,6 @@
 from unorthodox import (BLACK, DoubleStepPawn, OrthodoxPosition, WHITE,
                         black_bishop, black_king, black_knight, black_queen,
-                        black_rook, play, white_bishop, white_king,
+                        black_rook, index, play, white_bishop, white_king,
                         white_knight, white_queen, white_rook)
 
 
@@ -43,10 +43,10 @@ position[7, 4] = white_king
 position[7, 5] = white_bishop
 position[7, 6] = white_knight
 position[7, 7] = white_rook
-position.royal[WHITE] = 7, 4
-position.royal[BLACK] = 0, 4
+position.royal[WHITE] = index(7, 4)
+position.royal[BLACK] = index(0, 4)
 position.castling = [True, True, True, True]
 if __name__ == "__main__":
     print("Standard-rules chess, inventor unknown")
     print("Rules: https://www.chessvariants.com/d.chess/chess.html")
-    play(position, 10)
+    play(position, 10, book="orthodoxchess.book")
@@ -1,6 +1,6 @@
-from unorthodox import (BLACK, EnPassantPosition, DoubleStepPawn, WHITE,
+from unorthodox import (BLACK, DoubleStepPawn, EnPassantPosition, WHITE,
                         black_bishop, black_king, black_knight, black_queen,
-                        black_rook, play, white_bishop, white_king,
+                        black_rook, index, play, white_bishop, white_king,
                         white_knight, white_queen, white_rook)
 
 
@@ -23,9 +23,9 @@ position[6, 5] = white_pawn
 position[6, 6] = white_pawn
 position[6, 7] = white_pawn
 position[7, 4] = white_king
-position.royal[WHITE] = 7, 4
-position.royal[BLACK] = 0, 4
+position.royal[WHITE] = index(7, 4)
+position.royal[BLACK] = index(0, 4)
 if __name__ == "__main__":
     print("Peasants' Revolt, inventor unknown")
     print("Rules: https://www.chessvariants.com/large.dir/peasantrevolt.html")
-    play(position, 10)
+    play(position, 10, book="peasantsrevolt.book")
@@ -1,5 +1,5 @@
-from unorthodox import (BLACK, LOSS, Leaper, NEUTRAL, Position, SingleStepPawn,
-                        WHITE, black_king, black_knight, black_rook, play,
+from unorthodox import (BLACK, LOSS, Leaper, Position, SingleStepPawn, WHITE,
+                        black_king, black_knight, black_rook, index, play,
                         white_king, white_knight, white_rook)
 
 
@@ -16,25 +16,16 @@ class Elephant(Leaper):
 class BareKingPosition(Position):
     """A board with support for the bare king rule."""
 
-    def __init__(self, **kwargs):
-        Position.__init__(self, **kwargs)
-        if "copy" in kwargs:
-            self.pieces = dict(kwargs["copy"].pieces)
-        else:
-            self.pieces = {WHITE: 0, BLACK: 0}
-
-    def __setitem__(self, square, piece):
-        """Put a piece on a square and update the piece count."""
-        if self[square].player != NEUTRAL:
-            self.pieces[self[square].player] -= 1
-        if piece.player != NEUTRAL:
-            self.pieces[piece.player] += 1
-        Position.__setitem__(self, square, piece)
-
     def check(self, defender):
         """Return True if the defender's king is in check or bare."""
-        return (Position.check(self, defender) or self.pieces[defender] == 1
-                and self.pieces[-defender] > 1)
+        return (Position.check(self, defender)
+                or len(self.occupied[defender]) == 1
+                and len(self.occupied[-defender]) > 1)
+
+    def zugzwang(self):
+        # near a bare king, passing the turn can decide the game
+        return (Position.zugzwang(self) or len(self.occupied[WHITE]) <= 2
+                or len(self.occupied[BLACK]) <= 2)
 
 
 white_ferz = Ferz(WHITE, "F")
@@ -76,9 +67,11 @@ position[7, 4] = white_ferz
 position[7, 5] = white_elephant
 position[7, 6] = white_knight
 position[7, 7] = white_rook
-position.royal[WHITE] = 7, 3
-position.royal[BLACK] = 0, 3
+position.royal[WHITE] = index(7, 3)
+position.royal[BLACK] = index(0, 3)
+# the stalemated player loses
+stalemate = LOSS
 if __name__ == "__main__":
     print("Shatranj, inventor unknown")
     print("Rules: https://www.chessvariants.com/historic.dir/shatranj.html")
-    play(position, 10, stalemate=LOSS)
+    play(position, 10, stalemate=stalemate, book="shatranj.book")
@@ -1,10 +1,12 @@
-from unorthodox import (BLACK, King, Leaper, OrthodoxPosition, Queen, WHITE,
-                        black_bishop, black_king, black_knight, black_rook,
-                        play, white_bishop, white_king, white_knight,
-                        white_rook)
+from unorthodox import (BLACK, King, Leaper, Move, OrthodoxPosition, Queen,
+                        WHITE, black_bishop, black_king, black_knight,
+                        black_rook, index, play, white_bishop, white_king,
+                        white_knight, white_rook, zobrist)
 
 
 class SuperFarmerPosition(OrthodoxPosition):
+    queens_moved_keys = dict(zip((WHITE, BLACK), zobrist("queens moved", 2)))
+
     def __init__(self, **kwargs):
         OrthodoxPosition.__init__(self, **kwargs)
         if "copy" in kwargs:
@@ -12,11 +14,25 @@ class SuperFarmerPosition(OrthodoxPosition):
         else:
             self.queens_moved = {WHITE: False, BLACK: False}
 
-    def make_move(self, origin, target):
-        move = OrthodoxPosition.make_move(self, origin, target)
-        if origin == (7, 3) or origin == (0, 3):
-            move.queens_moved[self.player] = True
-        return move
+    def do_move(self, move):
+        player = self.player
+        undo = OrthodoxPosition.do_move(self, move)
+        undo.queens_moved = self.queens_moved[player]
+        if move.origin == index(7, 3) or move.origin == index(0, 3):
+            if not self.queens_moved[player]:
+                self.hash ^= self.queens_moved_keys[player]
+            self.queens_moved[player] = True
+        return undo
+
+    def find_hash(self):
+        OrthodoxPosition.find_hash(self)
+        for player in WHITE, BLACK:
+            if self.queens_moved[player]:
+                self.hash ^= self.queens_moved_keys[player]
+
+    def undo_move(self, move, undo):
+        OrthodoxPosition.undo_move(self, move, undo)
+        self.queens_moved[self.player] = undo.queens_moved
 
 
 class SuperFarmerJumpingQueen(Leaper):
@@ -29,11 +45,38 @@ class SuperFarmerJumpingQueen(Leaper):
 class SuperFarmerQueen(King):
     value = 375
 
+    def __init__(self, player, symbol):
+        King.__init__(self, player, symbol)
+        self.jumps = self.deltas(SuperFarmerJumpingQueen.offsets)
+        self.reverse_jumps = tuple(-jump for jump in self.jumps)
+        # jumps are confirmed by attacks
+        self.attack_leaps = self.steps + self.jumps
+
+    def attack_mask(self, position, origin):
+        mask = King.attack_mask(self, position, origin)
+        if not position.queens_moved[self.player]:
+            mask |= position.leap_masks(self.jumps)[origin]
+        return mask
+
+    def attacked_squares(self, position, origin):
+        squares = King.attacked_squares(self, position, origin)
+        if not position.queens_moved[self.player]:
+            squares += position.leaps(self.jumps)[origin]
+        return squares
+
     def attacks(self, position, square, origin):
         if King.attacks(self, position, square, origin):
             return True
-        if not position.queens_moved[position.player]:
-            if SuperFarmerJumpingQueen.attacks(self, position, square, origin):
+        if not position.queens_moved[self.player]:
+            if square - origin in self.jumps:
+                return True
+        return False
+
+    def attacks_from(self, position, square, bits):
+        if King.attacks_from(self, position, square, bits):
+            return True
+        if not position.queens_moved[self.player]:
+            if bits & position.leap_masks(self.reverse_jumps)[square]:
                 return True
         return False
 
@@ -42,8 +85,11 @@ class SuperFarmerQueen(King):
         moves = King.generate_moves(self, position, origin)
         # jumps
         if not position.queens_moved[position.player]:
-            moves += SuperFarmerJumpingQueen.generate_moves(self, position,
-                                                            origin)
+            board = position.board
+            for target in position.leaps(self.jumps)[origin]:
+                # empty or capturable
+                if board[target].player != self.player:
+                    moves.append(Move(origin, target))
         return moves
 
 
@@ -84,10 +130,10 @@ position[7, 4] = white_king
 position[7, 5] = white_bishop
 position[7, 6] = white_knight
 position[7, 7] = white_rook
-position.royal[WHITE] = 7, 4
-position.royal[BLACK] = 0, 4
+position.royal[WHITE] = index(7, 4)
+position.royal[BLACK] = index(0, 4)
 position.castling = [True, True, True, True]
 if __name__ == "__main__":
     print("Super Farmer Chess by @krasmanalderey on Twitter")
     print("Rules: https://pastebin.com/Ujg0XgPk")
-    play(position, 10)
+    play(position, 10, book="superfarmerchess.book")
@@ -1,5 +1,13 @@
-from random import choice
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait
+from mmap import ACCESS_READ, mmap
+from multiprocessing import Value
+from multiprocessing.shared_memory import SharedMemory
+from os.path import exists, getsize
+from random import Random, choice
+from struct import pack, unpack
 from threading import Thread
+from time import monotonic
 
 
 # A framework for implementing chess variants with a basic computer opponent
@@ -20,10 +28,127 @@ RANDOM = 3
 WIN = 1
 DRAW = 0
 LOSS = -1
+EXACT = 0
+LOWER = 1
+UPPER = 2
+ASPIRATION_WINDOW = 50
+DELTA_MARGIN = 200
+LATE_MOVES = 3
+POLL_NODES = 256
+QUIESCENCE_DEPTH = 4
+SOFT_TIME = 0.5
+STABLE_ITERATIONS = 3
+
+
+# Board geometry
+#
+# Boards are stored as flat lists. Every square is identified by its index into
+# that list and the playable area is surrounded by lava, so pieces step by
+# integer deltas and leaving the board simply means running into lava. The
+# padding must be at least as wide as the longest leap (the Omega Chess
+# wizard's (3, 1)), the stride limits boards to 26 files.
+
+PADDING = 3
+STRIDE = 32
+
+
+def coordinates(square):
+    """Convert a square index to a (rank, file) tuple."""
+    rank, file = divmod(square, STRIDE)
+    return rank - PADDING, file - PADDING
+
+
+def index(rank, file):
+    """Convert coordinates to a square index."""
+    return (rank + PADDING) * STRIDE + file + PADDING
+
+
+# Hashing
+#
+# Positions carry a Zobrist hash: the exclusive or of random 64-bit keys for
+# every piece on its square and for every other part of the state, e.g. the
+# player to move. Moves update it incrementally. The keys are seeded with
+# names, so hashes are the same in every run.
+
+zobrist_tables = {}
+
+
+def zobrist(name, length=STRIDE * STRIDE):
+    """Return a table of random keys for hashing positions.
+
+    The default length covers every square of boards with up to 26 ranks.
+    """
+    if name not in zobrist_tables:
+        random = Random(name)
+        zobrist_tables[name] = [random.getrandbits(64) for i in range(length)]
+    return zobrist_tables[name]
+
+
+# Moves
+
+class Move:
+    """A move, i.e. a description of the changes a piece makes to a position.
+
+    Moves are generated cheaply in large numbers, positions are only changed
+    (or copied) when a move is actually made.
+
+    Attributes:
+    origin -- The square of origin.
+    target -- The target square.
+    promotion -- The piece a pawn promotes to, if any.
+    victim -- The square of a piece captured en passant, if any.
+    rook_origin -- The square of origin of a castling rook, if any.
+    rook_target -- The target square of a castling rook, if any.
+    en_passant -- The square a pawn skipped with a double step, if any.
+    en_passant2 -- The second square a pawn skipped with a triple step.
+    """
+    __slots__ = ("origin", "target", "promotion", "victim", "rook_origin",
+                 "rook_target", "en_passant", "en_passant2")
+
+    def __init__(self, origin, target, promotion=None):
+        self.origin = origin
+        self.target = target
+        self.promotion = promotion
+        self.victim = None
+        self.rook_origin = None
+        self.rook_target = None
+        self.en_passant = None
+        self.en_passant2 = None
+
+    def __eq__(self, other):
+        return (isinstance(other, Move) and self.origin == other.origin
+                and self.target == other.target
+                and self.promotion is other.promotion)
+
+    def __hash__(self):
+        return hash((self.origin, self.target))
+
+    def number(self):
+        """Return a compact integer which identifies the move. Squares take
+        10 bits each, followed by the number of the promotion piece.
+        """
+        number = self.target << 10 | self.origin
+        if self.promotion is not None:
+            number |= self.promotion.number << 20
+        return number
+
+
+class Undo:
+    """What is needed to take back a move made in place. Positions with
+    additional state add their own attributes.
+    """
 
 
 # Piece types
 
+pieces = []  # all pieces in order of creation, see Piece.number
+
+
+def registered_piece(number):
+    """Return the piece with a given number, see Piece.number."""
+    return pieces[number]
+
+
 class Piece:
     """Base class of all piece types.
 
@@ -31,8 +156,20 @@ class Piece:
     value -- The piece's value in centipawns (a static field).
     generate_moves -- A method which generates all moves the piece can make.
     attacks -- Returns True if the piece attacks a particular square.
+
+    Pieces should also declare how they attack, so that positions can look
+    for attackers outward from a square (see Position.attacked): steps in
+    attack_leaps, attack_rides and attack_cannon_rides. The attacks method
+    confirms every attack found this way, so declaring more than a piece
+    always attacks is fine. Pieces which declare nothing are asked directly.
+
+    Pieces may also provide attack_mask and attacks_from to speed up positions
+    with bitboards, see BitboardPosition.
     """
     value = 0
+    attack_leaps = None
+    attack_rides = None
+    attack_cannon_rides = None
 
     def __init__(self, player, symbol):
         """Initialize the piece.
@@ -43,6 +180,65 @@ class Piece:
         """
         self.player = player
         self.symbol = symbol
+        self.keys = zobrist(symbol)  # hash keys for every square
+        self.number = len(pieces)
+        pieces.append(self)
+
+    def __reduce__(self):
+        """Pickle the piece as its number, so that unpickling, e.g. in another
+        process which created the same pieces, finds the same piece.
+        """
+        return registered_piece, (self.number,)
+
+    def attack_mask(self, position, origin):
+        """Return a bitboard of the squares the piece attacks from a square.
+
+        This default asks attacks about every square of the board.
+        """
+        mask = 0
+        for square, piece in enumerate(position.board):
+            if piece is not lava and self.attacks(position, square, origin):
+                mask |= 1 << square
+        return mask
+
+    def attacked_squares(self, position, origin):
+        """Return the squares the piece attacks from a square.
+
+        This default asks attacks about every square of the board.
+        """
+        return [square for square, piece in enumerate(position.board)
+                if piece is not lava
+                and self.attacks(position, square, origin)]
+
+    def attacks_from(self, position, square, bits):
+        """Return True if a piece of this type on one of the squares of a
+        bitboard attacks a square.
+
+        This default asks attacks about each of these squares.
+        """
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            if self.attacks(position, square, bit.bit_length() - 1):
+                return True
+        return False
+
+    def deltas(self, offsets):
+        """Convert (rank, file) offsets to square index deltas as seen from the
+        piece's owner.
+        """
+        return tuple(self.player * i * STRIDE + j for i, j in offsets)
+
+    def square_value(self, position, square):
+        """Return the value of the piece on a square in centipawns as seen
+        from its owner: the piece's value minus four times the square of
+        center distance.
+
+        This is what piece-square tables are built from, see
+        Position.square_table. Override it for piece types that belong
+        elsewhere than the center.
+        """
+        return self.value - 4 * position.scd(square) + 50
 
 
 class CannonRider(Piece):
@@ -50,58 +246,66 @@ class CannonRider(Piece):
     cannon in Xiangji.
     """
 
+    def __init__(self, player, symbol):
+        Piece.__init__(self, player, symbol)
+        self.steps = self.deltas(self.offsets)
+        self.reverse_steps = tuple(-step for step in self.steps)
+        self.attack_cannon_rides = self.steps
+
+    def attack_mask(self, position, origin):
+        return position.cannon_attacks(self.steps, origin)
+
+    def attacked_squares(self, position, origin):
+        squares = []
+        board = position.board
+        for ray in position.rays(self.steps)[origin]:
+            targets = iter(ray)
+            # find the screen
+            for target in targets:
+                if board[target] is not empty:
+                    break
+            # attack up to the next square that is not empty
+            for target in targets:
+                squares.append(target)
+                if board[target] is not empty:
+                    break
+        return squares
+
     def attacks(self, position, square, origin):
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            while position.empty(target):
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
-            target = (
-                target[0] + self.player * offset[0],
-                target[1] + offset[1]
-            )
-            while position.empty(target):
+        board = position.board
+        for ray in position.rays(self.steps)[origin]:
+            targets = iter(ray)
+            # find the screen
+            for target in targets:
+                if board[target] is not empty:
+                    break
+            # attack the first square after the screen that is not empty
+            for target in targets:
                 if target == square:
                     return True
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
-            if target == square:
-                return True
+                if board[target] is not empty:
+                    break
         return False
 
+    def attacks_from(self, position, square, bits):
+        return position.cannon_attacks_from(self.reverse_steps, square, bits)
+
     def generate_moves(self, position, origin):
         moves = []
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            while position.empty(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
-            target = (
-                target[0] + self.player * offset[0],
-                target[1] + offset[1]
-            )
-            while position.empty(target):
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
-            if position.capturable(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
+        board = position.board
+        for ray in position.rays(self.steps)[origin]:
+            targets = iter(ray)
+            # non-captures up to the screen
+            for target in targets:
+                if board[target] is not empty:
+                    break
+                moves.append(Move(origin, target))
+            # capture after the screen
+            for target in targets:
+                if board[target] is not empty:
+                    if position.capturable(target):
+                        moves.append(Move(origin, target))
+                    break
         return moves
 
 
@@ -111,84 +315,102 @@ class Leaper(Piece):
     base class.
     """
 
+    def __init__(self, player, symbol):
+        Piece.__init__(self, player, symbol)
+        self.steps = self.deltas(self.offsets)
+        self.reverse_steps = tuple(-step for step in self.steps)
+        self.attack_leaps = self.steps
+
+    def attack_mask(self, position, origin):
+        return position.leap_masks(self.steps)[origin]
+
+    def attacked_squares(self, position, origin):
+        return position.leaps(self.steps)[origin]
+
     def attacks(self, position, square, origin):
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            if target == square:
-                return True
-        return False
+        return square - origin in self.steps
+
+    def attacks_from(self, position, square, bits):
+        return bits & position.leap_masks(self.reverse_steps)[square] != 0
 
     def generate_moves(self, position, origin):
+        if position.bitboards is not None:
+            return position.mask_moves(
+                origin, position.leap_masks(self.steps)[origin])
         moves = []
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            if position.capturable_or_empty(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
+        board = position.board
+        for target in position.leaps(self.steps)[origin]:
+            # empty or capturable
+            if board[target].player != self.player:
+                moves.append(Move(origin, target))
         return moves
 
 
 class LeaperRider(Piece):
     """Base class of compounds of leapers and riders."""
 
+    def __init__(self, player, symbol):
+        Piece.__init__(self, player, symbol)
+        self.rider_steps = self.deltas(self.rider_offsets)
+        self.leaper_steps = self.deltas(self.leaper_offsets)
+        self.reverse_rider_steps = tuple(-step for step in self.rider_steps)
+        self.reverse_leaper_steps = tuple(-step for step in self.leaper_steps)
+        self.attack_leaps = self.leaper_steps
+        self.attack_rides = self.rider_steps
+
+    def attack_mask(self, position, origin):
+        return (position.rider_attacks(self.rider_steps, origin)
+                | position.leap_masks(self.leaper_steps)[origin])
+
+    def attacked_squares(self, position, origin):
+        squares = list(position.leaps(self.leaper_steps)[origin])
+        board = position.board
+        for ray in position.rays(self.rider_steps)[origin]:
+            for target in ray:
+                squares.append(target)
+                if board[target] is not empty:
+                    break
+        return squares
+
     def attacks(self, position, square, origin):
+        # leaper attacks
+        if square - origin in self.leaper_steps:
+            return True
         # rider attacks
-        for offset in self.rider_offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            while position.empty(target):
+        board = position.board
+        for ray in position.rays(self.rider_steps)[origin]:
+            for target in ray:
                 if target == square:
                     return True
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1])
-            if target == square:
-                return True
-        # leaper attacks
-        for offset in self.leaper_offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            if target == square:
-                return True
+                if board[target] is not empty:
+                    break
         return False
 
+    def attacks_from(self, position, square, bits):
+        return (bits & position.leap_masks(self.reverse_leaper_steps)[square]
+                != 0 or position.rider_attacks_from(self.reverse_rider_steps,
+                                                    square, bits))
+
     def generate_moves(self, position, origin):
+        if position.bitboards is not None:
+            return position.mask_moves(
+                origin, position.rider_attacks(self.rider_steps, origin)
+                | position.leap_masks(self.leaper_steps)[origin])
         moves = []
+        board = position.board
         # rider moves
-        for offset in self.rider_offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            while position.empty(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
-            if position.capturable(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
+        for ray in position.rays(self.rider_steps)[origin]:
+            for target in ray:
+                if board[target] is not empty:
+                    if position.capturable(target):
+                        moves.append(Move(origin, target))
+                    break
+                moves.append(Move(origin, target))
         # leaper moves
-        for offset in self.leaper_offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            if position.capturable_or_empty(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
+        for target in position.leaps(self.leaper_steps)[origin]:
+            # empty or capturable
+            if board[target].player != self.player:
+                moves.append(Move(origin, target))
         return moves
 
 
@@ -197,40 +419,51 @@ class Rider(Piece):
     rook. This is their base class.
     """
 
+    def __init__(self, player, symbol):
+        Piece.__init__(self, player, symbol)
+        self.steps = self.deltas(self.offsets)
+        self.reverse_steps = tuple(-step for step in self.steps)
+        self.attack_rides = self.steps
+
+    def attack_mask(self, position, origin):
+        return position.rider_attacks(self.steps, origin)
+
+    def attacked_squares(self, position, origin):
+        squares = []
+        board = position.board
+        for ray in position.rays(self.steps)[origin]:
+            for target in ray:
+                squares.append(target)
+                if board[target] is not empty:
+                    break
+        return squares
+
     def attacks(self, position, square, origin):
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            while position.empty(target):
+        board = position.board
+        for ray in position.rays(self.steps)[origin]:
+            for target in ray:
                 if target == square:
                     return True
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
-            if target == square:
-                return True
+                if board[target] is not empty:
+                    break
         return False
 
+    def attacks_from(self, position, square, bits):
+        return position.rider_attacks_from(self.reverse_steps, square, bits)
+
     def generate_moves(self, position, origin):
+        if position.bitboards is not None:
+            return position.mask_moves(
+                origin, position.rider_attacks(self.steps, origin))
         moves = []
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            while position.empty(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
-                target = (
-                    target[0] + self.player * offset[0],
-                    target[1] + offset[1]
-                )
-            if position.capturable(target):
-                move = position.make_move(origin, target)
-                moves.append(move)
+        board = position.board
+        for ray in position.rays(self.steps)[origin]:
+            for target in ray:
+                if board[target] is not empty:
+                    if position.capturable(target):
+                        moves.append(Move(origin, target))
+                    break
+                moves.append(Move(origin, target))
         return moves
 
 
@@ -242,56 +475,54 @@ class SingleStepPawn(Piece):
     def __init__(self, player, symbol, promotions):
         Piece.__init__(self, player, symbol)
         self.promotions = promotions
+        self.steps = self.deltas(self.offsets)
+        self.reverse_steps = tuple(-step for step in self.steps)
+        self.attack_leaps = self.steps
+        self.forward = -player * STRIDE
+
+    def attack_mask(self, position, origin):
+        return position.leap_masks(self.steps)[origin]
+
+    def attacked_squares(self, position, origin):
+        return position.leaps(self.steps)[origin]
 
     def attacks(self, position, square, origin):
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
-            if target == square:
-                return True
-        return False
+        return square - origin in self.steps
+
+    def attacks_from(self, position, square, bits):
+        return bits & position.leap_masks(self.reverse_steps)[square] != 0
 
     def can_promote(self, position, square):
-        return (self.player == WHITE and square[0] == 0 or self.player == BLACK
-                and square[0] == position.size[0] - 1)
+        rank = coordinates(square)[0]
+        return (self.player == WHITE and rank == 0 or self.player == BLACK
+                and rank == position.size[0] - 1)
 
     def generate_moves(self, position, origin):
         moves = []
         # captures
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
+        for step in self.steps:
+            target = origin + step
             if position.capturable(target):
                 # promotions
                 if self.can_promote(position, target):
                     moves += self.generate_promotions(position, origin, target)
                 else:
-                    move = position.make_move(origin, target)
+                    move = Move(origin, target)
                     moves.append(move)
         # non captures
-        target = (
-            origin[0] - self.player,
-            origin[1]
-        )
+        target = origin + self.forward
         if position.empty(target):
             # promotions
             if self.can_promote(position, target):
                 moves += self.generate_promotions(position, origin, target)
             else:
-                moves.append(position.make_move(origin, target))
+                moves.append(Move(origin, target))
         return moves
 
     def generate_promotions(self, position, origin, target):
         moves = []
         for promotion in self.promotions:
-            move = position.make_move(origin, target)
-            move[target] = promotion
-            move.notation += promotion.symbol
-            moves.append(move)
+            moves.append(Move(origin, target, promotion))
         return moves
 
 
@@ -344,34 +575,21 @@ class DoubleStepPawn(SingleStepPawn):
     def generate_moves(self, position, origin):
         moves = SingleStepPawn.generate_moves(self, position, origin)
         # en passant
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
+        for step in self.steps:
+            target = origin + step
             if target == position.en_passant:
-                move = position.make_move(origin, target)
-                # coordinates of the captured pawn
-                square = (
-                    target[0] + self.player,
-                    target[1]
-                )
-                move[square] = empty
+                move = Move(origin, target)
+                # square of the captured pawn
+                move.victim = target - self.forward
                 moves.append(move)
         # double step
-        if origin[0] == self.initial_rank:
+        if coordinates(origin)[0] == self.initial_rank:
             # the intermediate square
-            square = (
-                origin[0] - self.player,
-                origin[1]
-            )
+            square = origin + self.forward
             if position.empty(square):
-                target = (
-                    square[0] - self.player,
-                    square[1]
-                )
+                target = square + self.forward
                 if position.empty(target):
-                    move = position.make_move(origin, target)
+                    move = Move(origin, target)
                     move.en_passant = square
                     moves.append(move)
         return moves
@@ -383,40 +601,24 @@ class TripleStepPawn(DoubleStepPawn):
     def generate_moves(self, position, origin):
         moves = DoubleStepPawn.generate_moves(self, position, origin)
         # en passant
-        for offset in self.offsets:
-            target = (
-                origin[0] + self.player * offset[0],
-                origin[1] + offset[1]
-            )
+        for step in self.steps:
+            target = origin + step
             if target == position.en_passant2:
-                move = position.make_move(origin, target)
-                # coordinates of the captured pawn
-                square = (
-                    target[0] + 2 * self.player,
-                    target[1]
-                )
-                move[square] = empty
+                move = Move(origin, target)
+                # square of the captured pawn
+                move.victim = target - 2 * self.forward
                 moves.append(move)
         # triple step
-        if origin[0] == self.initial_rank:
+        if coordinates(origin)[0] == self.initial_rank:
             # first intermediate square
-            square1 = (
-                origin[0] - self.player,
-                origin[1]
-            )
+            square1 = origin + self.forward
             if position.empty(square1):
                 # second intermediate square
-                square2 = (
-                    square1[0] - self.player,
-                    square1[1]
-                )
+                square2 = square1 + self.forward
                 if position.empty(square2):
-                    target = (
-                        square2[0] - self.player,
-                        square2[1]
-                    )
+                    target = square2 + self.forward
                     if position.empty(target):
-                        move = position.make_move(origin, target)
+                        move = Move(origin, target)
                         move.en_passant = square2
                         move.en_passant2 = square1
                         moves.append(move)
@@ -441,37 +643,112 @@ black_rook = Rook(BLACK, "r")
 
 # Positions
 
+# move and piece-square tables of every board geometry, see Position.leaps,
+# Position.rays, Position.square_table and BitboardPosition.leap_masks
+table_cache = {}
+
+
 class Position:
     """The base class of all positions."""
-    scd_cache = {}
+    side_key = zobrist("side to move", 1)[0]
+    # attack patterns of every player, see attack_patterns
+    pattern_cache = {}
+    # depth reductions of the search, variants may set them to 0 to turn
+    # null moves or late move reductions off
+    late_move_reduction = 1
+    null_move_reduction = 2
+    # see BitboardPosition, None as long as a position keeps no bitboards
+    bitboards = None
 
     def __init__(self, **kwargs):
         """Create a new empty position or copy an existing one."""
         if "copy" in kwargs:
             copy = kwargs["copy"]
-            self.board = [[j for j in i] for i in copy.board]
+            self.attack_maps = None, None  # see attack_map
+            self.board = list(copy.board)
+            self.evaluation = copy.evaluation
+            self.hash = copy.hash
+            self.occupied = {
+                WHITE: set(copy.occupied[WHITE]),
+                BLACK: set(copy.occupied[BLACK])
+            }
             self.player = copy.player
             self.royal = dict(copy.royal)
             self.size = copy.size
+            self.leap_tables = copy.leap_tables
+            self.ray_tables = copy.ray_tables
+            self.mask_tables = copy.mask_tables
+            self.square_tables = copy.square_tables
         else:
             size = kwargs["size"]
-            self.board = [[empty for j in range(size[1])] for i in
-                          range(size[0])]
+            self.attack_maps = None, None  # see attack_map
+            self.board = [lava] * (size[0] + 2 * PADDING) * STRIDE
+            for i in range(size[0]):
+                for j in range(size[1]):
+                    self.board[index(i, j)] = empty
+            self.evaluation = 0  # from white's point of view, see evaluate
+            self.hash = 0
+            # squares occupied by each player's pieces
+            self.occupied = {WHITE: set(), BLACK: set()}
             self.player = WHITE
             self.royal = {WHITE: None, BLACK: None}
             self.size = size
+            # move tables, looked up once the lava is in place
+            self.leap_tables = {}
+            self.ray_tables = {}
+            self.mask_tables = {}
+            self.square_tables = {}
 
     def __getitem__(self, square):
-        """Get a piece. Returns lava for coordinates out of bounds."""
-        if (square[0] >= 0 and square[0] < self.size[0] and square[1] >= 0
-                and square[1] < self.size[1]):
-            return self.board[square[0]][square[1]]
-        else:
-            return lava
+        """Get a piece.
+
+        Squares are indices, but (rank, file) tuples are accepted too. Returns
+        lava for coordinates out of bounds.
+        """
+        if type(square) is tuple:
+            if (square[0] < 0 or square[0] >= self.size[0] or square[1] < 0
+                    or square[1] >= self.size[1]):
+                return lava
+            square = index(*square)
+        return self.board[square]
+
+    def __getstate__(self):
+        """Return a compact state for pickle: the board as piece numbers and
+        no move tables, which can be looked up again.
+        """
+        state = dict(self.__dict__)
+        state["board"] = array("H", [piece.number for piece in self.board])
+        for name in ("attack_maps", "leap_tables", "ray_tables", "mask_tables",
+                     "square_tables"):
+            del state[name]
+        return state
 
     def __setitem__(self, square, piece):
-        """Set a piece."""
-        self.board[square[0]][square[1]] = piece
+        """Put a piece on a square and update the occupied squares, the
+        evaluation and the hash.
+        """
+        if type(square) is tuple:
+            square = index(*square)
+        old = self.board[square]
+        if old.player != NEUTRAL:
+            self.occupied[old.player].remove(square)
+            self.evaluation -= self.square_table(old)[square]
+            self.hash ^= old.keys[square]
+        if piece.player != NEUTRAL:
+            self.occupied[piece.player].add(square)
+            self.evaluation += self.square_table(piece)[square]
+            self.hash ^= piece.keys[square]
+        self.board[square] = piece
+
+    def __setstate__(self, state):
+        """Restore a position pickled with __getstate__."""
+        self.__dict__.update(state)
+        self.attack_maps = None, None  # see attack_map
+        self.board = [pieces[number] for number in state["board"]]
+        self.leap_tables = {}
+        self.ray_tables = {}
+        self.mask_tables = {}
+        self.square_tables = {}
 
     def __str__(self):
         """Draw an ASCII art diagram of the position."""
@@ -487,267 +764,1782 @@ class Position:
         buffer.append("\n")
         return "".join(buffer)
 
+    def attack_map(self, player):
+        """Return a list which counts, for every square, the player's pieces
+        attacking it.
+
+        The maps are kept until the position changes, so rules that ask about
+        many squares pay for one map per position.
+        """
+        hash, maps = self.attack_maps
+        if hash != self.hash:
+            maps = {}
+            self.attack_maps = self.hash, maps
+        if player not in maps:
+            board = self.board
+            counts = [0] * len(board)
+            for origin in self.occupied[player]:
+                for square in board[origin].attacked_squares(self, origin):
+                    counts[square] += 1
+            maps[player] = counts
+        return maps[player]
+
+    def attack_patterns(self, player):
+        """Return the attack patterns of a player's piece types: tuples of
+        (step, piece types) pairs for leaps, rides and cannon rides, and the
+        set of piece types which declare no patterns.
+
+        All piece types created so far count, as any of them might turn up by
+        promotion.
+        """
+        count, patterns = self.pattern_cache.get(player, (None, None))
+        if count == len(pieces):
+            return patterns
+        leaps, rides, cannon_rides = {}, {}, {}
+        irregular = set()
+        for piece in pieces:
+            if piece.player != player:
+                continue
+            if (piece.attack_leaps is None and piece.attack_rides is None
+                    and piece.attack_cannon_rides is None):
+                irregular.add(piece)
+                continue
+            for table, steps in ((leaps, piece.attack_leaps),
+                                 (rides, piece.attack_rides),
+                                 (cannon_rides, piece.attack_cannon_rides)):
+                for step in steps or ():
+                    table.setdefault(step, set()).add(piece)
+        patterns = []
+        for table in leaps, rides, cannon_rides:
+            patterns.append(tuple((step, frozenset(attackers))
+                                  for step, attackers in table.items()))
+        patterns = tuple(patterns) + (frozenset(irregular),)
+        self.pattern_cache[player] = len(pieces), patterns
+        return patterns
+
     def attacked(self, square, attacker):
-        """Return True if a particular square is attacked by a player."""
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                origin = i, j
-                if (self[origin].player == attacker
-                        and self[origin].attacks(self, square, origin)):
+        """Return True if a particular square is attacked by a player.
+
+        Attackers are looked for outward from the square, as if a super-piece
+        combining all attack patterns stood there.
+        """
+        board = self.board
+        leaps, rides, cannon_rides, irregular = self.attack_patterns(attacker)
+        for step, attackers in leaps:
+            origin = square - step
+            piece = board[origin]
+            if piece in attackers and piece.attacks(self, square, origin):
+                return True
+        for step, attackers in rides:
+            origin = square - step
+            while board[origin] is empty:
+                origin -= step
+            piece = board[origin]
+            if piece in attackers and piece.attacks(self, square, origin):
+                return True
+        for step, attackers in cannon_rides:
+            # find the screen
+            origin = square - step
+            while board[origin] is empty:
+                origin -= step
+            if board[origin] is lava:
+                continue
+            # find the piece behind it
+            origin -= step
+            while board[origin] is empty:
+                origin -= step
+            piece = board[origin]
+            if piece in attackers and piece.attacks(self, square, origin):
+                return True
+        # pieces which declare no patterns
+        if irregular:
+            for origin in self.occupied[attacker]:
+                piece = board[origin]
+                if piece in irregular and piece.attacks(self, square, origin):
                     return True
         return False
 
     def capturable(self, square):
         """Return True if a piece belongs to the moving player's opponent."""
-        return self[square].player == -self.player
+        return self.board[square].player == -self.player
 
     def capturable_or_empty(self, square):
         return self.capturable(square) or self.empty(square)
 
+    def certify(self, move, pins):
+        """Return True if a pseudo-legal move is known to be legal, False if
+        it is known to be illegal and None if it has to be made and tested.
+
+        Parameters:
+        move -- A pseudo-legal move.
+        pins -- What the pins method found out about the position.
+        """
+        if (pins is None or move.origin == self.royal[self.player]
+                or move.victim is not None or move.rook_origin is not None):
+            return None
+        pinned, evasions = pins
+        if evasions is not None and move.target not in evasions:
+            return False
+        if move.origin in pinned and move.target not in pinned[move.origin]:
+            return None
+        return True
+
     def check(self, defender):
         """Return True if the defender's king is in check."""
         return self.attacked(self.royal[defender], -defender)
 
+    def do_move(self, move):
+        """Make a move in place and return an undo record for undo_move."""
+        undo = Undo()
+        undo.hash = self.hash
+        undo.piece = self.board[move.origin]
+        undo.capture = self.board[move.target]
+        undo.royal = self.royal[self.player]
+        # move piece
+        if move.promotion is None:
+            self[move.target] = undo.piece
+        else:
+            self[move.target] = move.promotion
+        self[move.origin] = empty
+        # capture en passant
+        if move.victim is not None:
+            undo.victim = self.board[move.victim]
+            self[move.victim] = empty
+        # move castling rook
+        if move.rook_origin is not None:
+            self[move.rook_target] = self.board[move.rook_origin]
+            self[move.rook_origin] = empty
+        # update royal positions
+        if move.origin == undo.royal:
+            self.royal[self.player] = move.target
+        # switch player
+        self.player *= -1
+        self.hash ^= self.side_key
+        return undo
+
     def empty(self, square):
         """Return True if a square is empty."""
-        return self[square] is empty
+        return self.board[square] is empty
 
     def evaluate(self):
-        """Evaluate the position in centipawns."""
-        score = 0
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                square = i, j
-                score += (self[square].player * (self[square].value - 4
-                                                 * self.scd(square) + 50))
-        return self.player * score
+        """Evaluate the position in centipawns.
+
+        The evaluation is summed up from piece-square tables as pieces are put
+        on and taken off squares, see __setitem__ and square_table.
+        """
+        return self.player * self.evaluation
+
+    def find_hash(self):
+        """Compute the hash from scratch, e.g. after setting up a position.
+        Moves update it incrementally.
+        """
+        self.hash = 0
+        for player in WHITE, BLACK:
+            for square in self.occupied[player]:
+                self.hash ^= self.board[square].keys[square]
+        if self.player == BLACK:
+            self.hash ^= self.side_key
+
+    def find_tables(self):
+        """Find the move tables shared by all positions with the same size
+        and lava layout.
+        """
+        layout = self.size, tuple(square for square, piece in
+                                  enumerate(self.board) if piece is lava)
+        if layout not in table_cache:
+            table_cache[layout] = {}, {}, {}, {}
+        (self.leap_tables, self.ray_tables, self.mask_tables,
+         self.square_tables) = table_cache[layout]
 
     def game_over(self):
         """Return True if there are no legal moves."""
         return len(self.generate_legal_moves()) == 0
 
+    def generate_captures(self):
+        """Generate a list of pseudo-legal captures and promotions."""
+        board = self.board
+        return [
+            move for move in self.generate_moves()
+            if board[move.target].player == -self.player
+            or move.victim is not None or move.promotion is not None
+        ]
+
     def generate_legal_moves(self):
         """Generate a list of legal moves."""
         legal_moves = []
+        pins = self.pins()
         for move in self.generate_moves():
-            if move.legal():
+            legal = self.certify(move, pins)
+            if legal is None:
+                undo = self.do_move(move)
+                legal = self.legal()
+                self.undo_move(move, undo)
+            if legal:
                 legal_moves.append(move)
         return legal_moves
 
     def generate_moves(self):
         """Generate a list of pseudo-legal moves."""
         moves = []
-        for i in range(self.size[0]):
-            for j in range(self.size[1]):
-                origin = i, j
-                if self.movable(origin):
-                    moves += self[origin].generate_moves(self, origin)
+        board = self.board
+        for origin in self.occupied[self.player]:
+            moves += board[origin].generate_moves(self, origin)
         return moves
 
+    def leaps(self, steps):
+        """Return a table of leaps: for every square, the squares reached by
+        the given steps, leaving out lava.
+        """
+        try:
+            return self.leap_tables[steps]
+        except KeyError:
+            self.find_tables()
+        if steps not in self.leap_tables:
+            board = self.board
+            table = [()] * len(board)
+            for square in range(len(board)):
+                if board[square] is not lava:
+                    table[square] = tuple(square + step for step in steps
+                                          if board[square + step] is not lava)
+            self.leap_tables[steps] = table
+        return self.leap_tables[steps]
+
     def legal(self):
         """Return True if the last move did not leave the king in check."""
         return (self.player == WHITE and not self.check(BLACK)
                 or self.player == BLACK and not self.check(WHITE))
 
-    def make_move(self, origin, target):
-        """Copy the position and move a piece on the copy.
-
-        Parameters:
-        origin -- The square of origin.
-        target -- The target square.
-        """
-        # copy position
-        move = type(self)(copy=self)
-        # move piece
-        move[target] = move[origin]
-        move[origin] = empty
-        # update royal positions
-        if origin == move.royal[move.player]:
-            move.royal[move.player] = target
-        # switch player
-        move.player *= -1
-        # set notation
-        move.notation = "%s%d%s%d" % (chr(origin[1] + 97), move.size[0]
-                                      - origin[0], chr(target[1] + 97),
-                                      move.size[0] - target[0])
-        return move
+    def make_move(self, move):
+        """Copy the position and make a move on the copy."""
+        copy = type(self)(copy=self)
+        copy.do_move(move)
+        return copy
 
     def movable(self, square):
         """Return True if a piece belongs to the moving player."""
-        return self[square].player == self.player
+        return self.board[square].player == self.player
+
+    def notation(self, move):
+        """Return the notation of a move, e.g. "e2e4" or "e7e8Q"."""
+        notation = (self.square_name(move.origin)
+                    + self.square_name(move.target))
+        if move.promotion is not None:
+            notation += move.promotion.symbol
+        return notation
+
+    def null_move(self):
+        """Copy the position and pass the turn on the copy."""
+        copy = type(self)(copy=self)
+        copy.player *= -1
+        copy.hash ^= self.side_key
+        return copy
+
+    def pins(self):
+        """Find the checks against the moving player's king and the pieces
+        pinned to it, so that certify can judge moves without making them.
+
+        Returns None if the opponent has pieces on the board whose attacks
+        a move might change in other ways, e.g. cannon riders. Otherwise
+        returns a pair: a dictionary of pinned pieces' squares and the
+        squares they may move to, and the squares where a move resolves the
+        check (empty for double check) or None if there is no check.
+        """
+        player = self.player
+        royal = self.royal[player]
+        board = self.board
+        leaps, rides, cannon_rides, irregular = self.attack_patterns(-player)
+        if cannon_rides or irregular:
+            unusual = irregular.union(*(attackers for step, attackers
+                                        in cannon_rides))
+            for square in self.occupied[-player]:
+                if board[square] in unusual:
+                    return None
+        pinned = {}
+        evasions = None
+        for step, attackers in leaps:
+            origin = royal - step
+            piece = board[origin]
+            if piece in attackers and piece.attacks(self, royal, origin):
+                evasions = {origin} if evasions is None else set()
+        for step, attackers in rides:
+            ray = []
+            origin = royal - step
+            while board[origin] is empty:
+                ray.append(origin)
+                origin -= step
+            piece = board[origin]
+            if piece.player == -player:
+                if piece in attackers and piece.attacks(self, royal, origin):
+                    ray.append(origin)
+                    evasions = set(ray) if evasions is None else set()
+            elif piece.player == player:
+                # look for a pinning piece behind the first one
+                blocker = origin
+                origin -= step
+                while board[origin] is empty:
+                    ray.append(origin)
+                    origin -= step
+                if board[origin] in attackers:
+                    ray.append(origin)
+                    if blocker in pinned:
+                        pinned[blocker] &= set(ray)
+                    else:
+                        pinned[blocker] = set(ray)
+        return pinned, evasions
+
+    def rays(self, steps):
+        """Return a table of rays: for every square, a tuple of rays in the
+        directions of the given steps, each ray being the squares up to the
+        next lava square.
+        """
+        try:
+            return self.ray_tables[steps]
+        except KeyError:
+            self.find_tables()
+        if steps not in self.ray_tables:
+            board = self.board
+            table = [()] * len(board)
+            for square in range(len(board)):
+                if board[square] is not lava:
+                    rays = []
+                    for step in steps:
+                        ray = []
+                        target = square + step
+                        while board[target] is not lava:
+                            ray.append(target)
+                            target += step
+                        if ray:
+                            rays.append(tuple(ray))
+                    table[square] = tuple(rays)
+            self.ray_tables[steps] = table
+        return self.ray_tables[steps]
 
     def scd(self, square):
         """Calculate the square of center distance (SCD)."""
-        if (self.size, square) in self.scd_cache:
-            return self.scd_cache[self.size, square]
-        i = abs(self.size[0] / 2 - square[0] - 0.5)
-        j = abs(self.size[1] / 2 - square[1] - 0.5)
-        scd = i ** 2 + j ** 2
-        self.scd_cache[self.size, square] = scd
-        return scd
+        rank, file = coordinates(square)
+        i = abs(self.size[0] / 2 - rank - 0.5)
+        j = abs(self.size[1] / 2 - file - 0.5)
+        return i ** 2 + j ** 2
+
+    def square_table(self, piece):
+        """Return the piece-square table of a piece: for every square, what
+        the piece adds to the evaluation from white's point of view.
+        """
+        try:
+            return self.square_tables[piece]
+        except KeyError:
+            self.find_tables()
+        if piece not in self.square_tables:
+            board = self.board
+            table = [0] * len(board)
+            for square in range(len(board)):
+                if board[square] is not lava:
+                    table[square] = (piece.player
+                                     * piece.square_value(self, square))
+            self.square_tables[piece] = table
+        return self.square_tables[piece]
+
+    def square_name(self, square):
+        """Return the name of a square, e.g. "e4"."""
+        rank, file = coordinates(square)
+        return "%s%d" % (chr(file + 97), self.size[0] - rank)
+
+    def undo_move(self, move, undo):
+        """Take back a move made by do_move."""
+        # switch player
+        self.player *= -1
+        # restore royal positions
+        self.royal[self.player] = undo.royal
+        # move castling rook back
+        if move.rook_origin is not None:
+            self[move.rook_origin] = self.board[move.rook_target]
+            self[move.rook_target] = empty
+        # restore pawn captured en passant
+        if move.victim is not None:
+            self[move.victim] = undo.victim
+        # move piece back
+        self[move.origin] = undo.piece
+        self[move.target] = undo.capture
+        # subclasses restore their state without touching the hash
+        self.hash = undo.hash
+
+    def zugzwang(self):
+        """Return True if the moving player has nothing but pawns and royal
+        pieces, so that passing might be better than any move.
+        """
+        board = self.board
+        for square in self.occupied[self.player]:
+            if (square != self.royal[self.player]
+                    and not isinstance(board[square], SingleStepPawn)):
+                return False
+        return True
+
+
+class BitboardPosition:
+    """A mixin which adds bitboards to a position: Python integers with one
+    bit per square index, marking the squares occupied by each piece type and
+    by all pieces. Attack detection and mobility become a few operations on
+    integers instead of loops over squares.
+
+    List it before the position class it extends, e.g.
+    class OmegaPosition(BitboardPosition, TripleStepEnPassantPosition). The
+    bitboards are built when they are first needed. Leapers, riders and
+    leaper-riders then generate their moves from bitboards as well.
+    """
 
+    def __setitem__(self, square, piece):
+        """Put a piece on a square and update the bitboards."""
+        if type(square) is tuple:
+            square = index(*square)
+        bitboards = self.bitboards
+        if bitboards is not None:
+            bit = 1 << square
+            old = self.board[square]
+            if old.player != NEUTRAL:
+                bitboards[old] ^= bit
+                self.occupancy ^= bit
+                self.player_occupancy[old.player] ^= bit
+            if piece.player != NEUTRAL:
+                bitboards[piece] = bitboards.get(piece, 0) | bit
+                self.occupancy |= bit
+                self.player_occupancy[piece.player] |= bit
+        super().__setitem__(square, piece)
 
-class EnPassantPosition(Position):
-    def __init__(self, **kwargs):
-        Position.__init__(self, **kwargs)
-        self.en_passant = None
+    def attacked(self, square, attacker):
+        """Return True if a particular square is attacked by a player."""
+        if self.bitboards is None:
+            self.build_bitboards()
+        for piece, bits in self.bitboards.items():
+            if (bits and piece.player == attacker
+                    and piece.attacks_from(self, square, bits)):
+                return True
+        return False
+
+    def build_bitboards(self):
+        """Build the bitboards from the board."""
+        self.bitboards = {}
+        self.occupancy = 0
+        # squares occupied by each player's pieces
+        self.player_occupancy = {WHITE: 0, BLACK: 0}
+        for player in WHITE, BLACK:
+            for square in self.occupied[player]:
+                piece = self.board[square]
+                self.bitboards[piece] = (self.bitboards.get(piece, 0)
+                                         | 1 << square)
+                self.player_occupancy[player] |= 1 << square
+            self.occupancy |= self.player_occupancy[player]
+
+    def cannon_attacks(self, steps, origin):
+        """Return a bitboard of the squares attacked by a cannon rider with
+        the given steps: on every ray, the squares behind the first occupied
+        square (the screen) up to and including the next occupied square.
+        """
+        attacks = 0
+        for ray, increasing in self.ray_masks(steps)[origin]:
+            blockers = ray & self.occupancy
+            if blockers:
+                # cut the ray in front of the screen and behind the next
+                # blocker
+                if increasing:
+                    screen = blockers & -blockers
+                    ray &= -(screen << 1)
+                    blockers ^= screen
+                    if blockers:
+                        ray &= ((blockers & -blockers) << 1) - 1
+                else:
+                    screen = 1 << blockers.bit_length() - 1
+                    ray &= screen - 1
+                    blockers ^= screen
+                    if blockers:
+                        ray &= -(1 << blockers.bit_length() - 1)
+                attacks |= ray
+        return attacks
+
+    def cannon_attacks_from(self, steps, square, bits):
+        """Return True if a cannon rider on one of the squares of a bitboard
+        attacks a square. The steps lead from the square to the cannon.
+        """
+        for ray, increasing in self.ray_masks(steps)[square]:
+            if ray & bits:
+                # the second blocker, skipping the screen
+                blockers = ray & self.occupancy
+                if increasing:
+                    blockers &= blockers - 1
+                    if blockers & -blockers & bits:
+                        return True
+                else:
+                    blockers ^= 1 << blockers.bit_length() - 1
+                    if blockers and 1 << blockers.bit_length() - 1 & bits:
+                        return True
+        return False
 
+    def generate_moves(self):
+        """Generate a list of pseudo-legal moves, building the bitboards
+        first so that the pieces can use them.
+        """
+        if self.bitboards is None:
+            self.build_bitboards()
+        return super().generate_moves()
+
+    def leap_masks(self, steps):
+        """Return the leaps table of the given steps as bitboards."""
+        try:
+            return self.mask_tables["leaps", steps]
+        except KeyError:
+            table = []
+            for targets in self.leaps(steps):
+                mask = 0
+                for target in targets:
+                    mask |= 1 << target
+                table.append(mask)
+            self.mask_tables["leaps", steps] = table
+            return table
+
+    def mask_moves(self, origin, mask):
+        """Return the moves from a square to the squares of a bitboard which
+        are empty or hold enemy pieces.
+        """
+        mask &= ~self.player_occupancy[self.player]
+        moves = []
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            moves.append(Move(origin, bit.bit_length() - 1))
+        return moves
 
-class OrthodoxPosition(EnPassantPosition):
-    """An 8x8 position with support for castling."""
+    def mobility(self, player):
+        """Return the number of squares attacked by a player's pieces which
+        are empty or hold enemy pieces, summed over the pieces.
+        """
+        if self.bitboards is None:
+            self.build_bitboards()
+        own = self.player_occupancy[player]
+        mobility = 0
+        for piece, bits in self.bitboards.items():
+            while bits and piece.player == player:
+                bit = bits & -bits
+                bits ^= bit
+                mask = piece.attack_mask(self, bit.bit_length() - 1) & ~own
+                mobility += bin(mask).count("1")
+        return mobility
+
+    def ray_masks(self, steps):
+        """Return the rays table of the given steps as bitboards: for every
+        square, a tuple of (ray, increasing) pairs where increasing tells if
+        the ray runs towards higher square indices.
+        """
+        try:
+            return self.mask_tables["rays", steps]
+        except KeyError:
+            table = []
+            for rays in self.rays(steps):
+                masks = []
+                for ray in rays:
+                    mask = 0
+                    for target in ray:
+                        mask |= 1 << target
+                    masks.append((mask, ray[0] <= ray[-1]))
+                table.append(tuple(masks))
+            self.mask_tables["rays", steps] = table
+            return table
+
+    def rider_attacks(self, steps, origin):
+        """Return a bitboard of the squares attacked by a rider with the given
+        steps: every ray up to and including its first occupied square.
+        """
+        attacks = 0
+        for ray, increasing in self.ray_masks(steps)[origin]:
+            blockers = ray & self.occupancy
+            if blockers:
+                # cut the ray behind the nearest blocker
+                if increasing:
+                    ray &= ((blockers & -blockers) << 1) - 1
+                else:
+                    ray &= -(1 << blockers.bit_length() - 1)
+            attacks |= ray
+        return attacks
+
+    def rider_attacks_from(self, steps, square, bits):
+        """Return True if a rider on one of the squares of a bitboard attacks
+        a square. The steps lead from the square to the rider.
+        """
+        for ray, increasing in self.ray_masks(steps)[square]:
+            if ray & bits:
+                # the nearest blocker
+                blockers = ray & self.occupancy
+                if increasing:
+                    if blockers & -blockers & bits:
+                        return True
+                elif 1 << blockers.bit_length() - 1 & bits:
+                    return True
+        return False
+
+
+class CastlingPosition:
+    """A mixin which adds castling to a position: the castling rights, their
+    hash keys and the castling moves.
+
+    List it before the position class it extends, e.g.
+    class OrthodoxPosition(CastlingPosition, EnPassantPosition). Positions
+    index castling rights as white kingside, white queenside, black kingside
+    and black queenside, and provide the following:
+    castling_squares -- The castling rights lost by moving from or to a square.
+    castling_keys -- The hash keys of the castling rights.
+    castling_moves -- For every castling right, the origin and target of the
+        king and of the rook.
+    white_kingside_castling etc. -- Methods which return True if a castling
+        is possible.
+    """
 
     def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         if "copy" in kwargs:
-            EnPassantPosition.__init__(self, **kwargs)
-            copy = kwargs["copy"]
-            self.castling = list(copy.castling)  # copy castling rights
+            self.castling = list(kwargs["copy"].castling)
         else:
-            EnPassantPosition.__init__(self, size=(8, 8))
             self.castling = [False, False, False, False]
 
-    def black_kingside_castling(self):
-        """Return True if black kingside castling is possible."""
-        return (self.castling[2] and self.empty((0, 5)) and self.empty((0, 6))
-                and not self.attacked((0, 4), WHITE) and not
-                self.attacked((0, 5), WHITE))
-
-    def black_queenside_castling(self):
-        """Return True if black queenside castling is possible."""
-        return (self.castling[3] and self.empty((0, 3)) and self.empty((0, 2))
-                and self.empty((0, 1)) and not self.attacked((0, 4), WHITE)
-                and not self.attacked((0, 3), WHITE))
+    def do_move(self, move):
+        undo = super().do_move(move)
+        # update castling rights
+        undo.castling = self.castling
+        for square in move.origin, move.target:
+            if square in self.castling_squares:
+                if self.castling is undo.castling:
+                    self.castling = list(self.castling)
+                for i in self.castling_squares[square]:
+                    if self.castling[i]:
+                        self.hash ^= self.castling_keys[i]
+                    self.castling[i] = False
+        return undo
+
+    def find_hash(self):
+        super().find_hash()
+        for i in range(len(self.castling)):
+            if self.castling[i]:
+                self.hash ^= self.castling_keys[i]
 
     def generate_moves(self):
-        moves = EnPassantPosition.generate_moves(self)
+        moves = super().generate_moves()
         # castling
         if self.player == WHITE:
-            if self.white_kingside_castling():
-                move = self.make_move((7, 4), (7, 6))
-                move[7, 5] = white_rook
-                move[7, 7] = empty
-                moves.append(move)
-            if self.white_queenside_castling():
-                move = self.make_move((7, 4), (7, 2))
-                move[7, 3] = white_rook
-                move[7, 0] = empty
-                moves.append(move)
+            castlings = ((0, self.white_kingside_castling),
+                         (1, self.white_queenside_castling))
         else:
-            if self.black_kingside_castling():
-                move = self.make_move((0, 4), (0, 6))
-                move[0, 5] = black_rook
-                move[0, 7] = empty
-                moves.append(move)
-            if self.black_queenside_castling():
-                move = self.make_move((0, 4), (0, 2))
-                move[0, 3] = black_rook
-                move[0, 0] = empty
+            castlings = ((2, self.black_kingside_castling),
+                         (3, self.black_queenside_castling))
+        for i, possible in castlings:
+            if possible():
+                origin, target, rook_origin, rook_target = (
+                    self.castling_moves[i])
+                move = Move(origin, target)
+                move.rook_origin = rook_origin
+                move.rook_target = rook_target
                 moves.append(move)
         return moves
 
-    def make_move(self, origin, target):
-        move = EnPassantPosition.make_move(self, origin, target)
-        # update castling rights
-        if origin == (7, 4) or origin == (7, 7) or target == (7, 7):
-            move.castling[0] = False
-        if origin == (7, 4) or origin == (7, 0) or target == (7, 0):
-            move.castling[1] = False
-        if origin == (0, 4) or origin == (0, 7) or target == (0, 7):
-            move.castling[2] = False
-        if origin == (0, 4) or origin == (0, 0) or target == (0, 0):
-            move.castling[3] = False
-        return move
+    def undo_move(self, move, undo):
+        super().undo_move(move, undo)
+        self.castling = undo.castling
+
+
+class EnPassantPosition(Position):
+    en_passant_keys = zobrist("en passant")
+
+    def __init__(self, **kwargs):
+        Position.__init__(self, **kwargs)
+        if "copy" in kwargs:
+            self.en_passant = kwargs["copy"].en_passant
+        else:
+            self.en_passant = None
+
+    def do_move(self, move):
+        undo = Position.do_move(self, move)
+        undo.en_passant = self.en_passant
+        if self.en_passant is not None:
+            self.hash ^= self.en_passant_keys[self.en_passant]
+        self.en_passant = move.en_passant
+        if self.en_passant is not None:
+            self.hash ^= self.en_passant_keys[self.en_passant]
+        return undo
+
+    def find_hash(self):
+        Position.find_hash(self)
+        if self.en_passant is not None:
+            self.hash ^= self.en_passant_keys[self.en_passant]
+
+    def null_move(self):
+        copy = Position.null_move(self)
+        if copy.en_passant is not None:
+            copy.hash ^= self.en_passant_keys[copy.en_passant]
+            copy.en_passant = None
+        return copy
+
+    def undo_move(self, move, undo):
+        Position.undo_move(self, move, undo)
+        self.en_passant = undo.en_passant
+
+
+class OrthodoxPosition(CastlingPosition, EnPassantPosition):
+    """An 8x8 position with support for castling."""
+    # castling rights lost by moving from or to a square
+    castling_squares = {
+        index(7, 4): (0, 1), index(7, 7): (0,), index(7, 0): (1,),
+        index(0, 4): (2, 3), index(0, 7): (2,), index(0, 0): (3,),
+    }
+    castling_keys = zobrist("castling", 4)
+    castling_moves = (
+        (index(7, 4), index(7, 6), index(7, 7), index(7, 5)),
+        (index(7, 4), index(7, 2), index(7, 0), index(7, 3)),
+        (index(0, 4), index(0, 6), index(0, 7), index(0, 5)),
+        (index(0, 4), index(0, 2), index(0, 0), index(0, 3)),
+    )
+
+    def __init__(self, **kwargs):
+        if "copy" in kwargs:
+            CastlingPosition.__init__(self, **kwargs)
+        else:
+            CastlingPosition.__init__(self, size=(8, 8))
+
+    def black_kingside_castling(self):
+        """Return True if black kingside castling is possible."""
+        return (self.castling[2] and self.empty(index(0, 5))
+                and self.empty(index(0, 6))
+                and not self.attack_map(WHITE)[index(0, 4)]
+                and not self.attack_map(WHITE)[index(0, 5)])
+
+    def black_queenside_castling(self):
+        """Return True if black queenside castling is possible."""
+        return (self.castling[3] and self.empty(index(0, 3))
+                and self.empty(index(0, 2)) and self.empty(index(0, 1))
+                and not self.attack_map(WHITE)[index(0, 4)]
+                and not self.attack_map(WHITE)[index(0, 3)])
 
     def white_kingside_castling(self):
         """Return True if white kingside castling is possible."""
-        return (self.castling[0] and self.empty((7, 5)) and self.empty((7, 6))
-                and not self.attacked((7, 4), BLACK) and not
-                self.attacked((7, 5), BLACK))
+        return (self.castling[0] and self.empty(index(7, 5))
+                and self.empty(index(7, 6))
+                and not self.attack_map(BLACK)[index(7, 4)]
+                and not self.attack_map(BLACK)[index(7, 5)])
 
     def white_queenside_castling(self):
         """Return True if white queenside castling is possible."""
-        return (self.castling[1] and self.empty((7, 3)) and self.empty((7, 2))
-                and self.empty((7, 1)) and not self.attacked((7, 4), BLACK)
-                and not self.attacked((7, 3), BLACK))
+        return (self.castling[1] and self.empty(index(7, 3))
+                and self.empty(index(7, 2)) and self.empty(index(7, 1))
+                and not self.attack_map(BLACK)[index(7, 4)]
+                and not self.attack_map(BLACK)[index(7, 3)])
 
 
 class TripleStepEnPassantPosition(EnPassantPosition):
+    en_passant2_keys = zobrist("en passant 2")
+
     def __init__(self, **kwargs):
         EnPassantPosition.__init__(self, **kwargs)
-        self.en_passant2 = None
+        if "copy" in kwargs:
+            self.en_passant2 = kwargs["copy"].en_passant2
+        else:
+            self.en_passant2 = None
+
+    def do_move(self, move):
+        undo = EnPassantPosition.do_move(self, move)
+        undo.en_passant2 = self.en_passant2
+        if self.en_passant2 is not None:
+            self.hash ^= self.en_passant2_keys[self.en_passant2]
+        self.en_passant2 = move.en_passant2
+        if self.en_passant2 is not None:
+            self.hash ^= self.en_passant2_keys[self.en_passant2]
+        return undo
+
+    def find_hash(self):
+        EnPassantPosition.find_hash(self)
+        if self.en_passant2 is not None:
+            self.hash ^= self.en_passant2_keys[self.en_passant2]
+
+    def null_move(self):
+        copy = EnPassantPosition.null_move(self)
+        if copy.en_passant2 is not None:
+            copy.hash ^= self.en_passant2_keys[copy.en_passant2]
+            copy.en_passant2 = None
+        return copy
+
+    def undo_move(self, move, undo):
+        EnPassantPosition.undo_move(self, move, undo)
+        self.en_passant2 = undo.en_passant2
 
 
 # AI
 
-best_move = None
-killer_moves = None
-nodes = None
-score = None
-stalemate_rule = None
-stop = None
+worker = None  # the engine of a worker process, see start_worker
 
 
-def alpha_beta(position, depth, alpha=-20000, beta=20000):
-    """Perform an alpha-beta search on a position.
+class TranspositionTable:
+    """A hash table of search results which never grows beyond its size.
 
-    Parameters:
-    position -- A position.
-    depth -- The search depth.
-    alpha -- The lower limit of the alpha-beta window.
-    beta -- The upper limit of the alpha-beta window.
+    Entries live in preallocated arrays and come in buckets of two: the first
+    entry is only replaced by searches at least as deep or by later searches,
+    the second one always.
     """
-    global nodes
-    if stop:
-        raise TimeoutError()
-    nodes += 1
-    if depth == 0:
-        return position.evaluate(), None
-    moves = position.generate_legal_moves()
-    # killer move presorting
-    moves.sort(key=lambda move: move.notation != killer_moves[depth - 1])
-    if len(moves) == 0:
-        if position.check(position.player):
-            return -20000, None
+    entry_size = 23  # bytes for hash, score, move, depth, bound and age
+
+    def __init__(self, size):
+        """Create a table of a given size in megabytes."""
+        self.buckets = max(1, size * 2 ** 20 // (2 * self.entry_size))
+        self.clear()
+
+    def clear(self):
+        """Remove all entries."""
+        entries = 2 * self.buckets
+        self.hashes = array("Q", [0]) * entries
+        self.scores = array("d", [0]) * entries
+        self.moves = array("i", [0]) * entries  # see Move.number
+        self.depths = array("b", [-1]) * entries
+        self.bounds = array("b", [EXACT]) * entries
+        self.ages = array("B", [0]) * entries
+        self.age = 0
+
+    def close(self):
+        """Free the table's memory."""
+        self.hashes = self.scores = self.moves = None
+        self.depths = self.bounds = self.ages = None
+
+    def new_search(self):
+        """Age the entries stored so far, so that deep results of earlier
+        searches give way to the next one.
+        """
+        self.age = (self.age + 1) % 256
+
+    def probe(self, hash):
+        """Return the depth, score, bound and move number stored for a hash
+        or None.
+        """
+        i = 2 * (hash % self.buckets)
+        if self.hashes[i] != hash:
+            i += 1
+            if self.hashes[i] != hash:
+                return None
+        return self.depths[i], self.scores[i], self.bounds[i], self.moves[i]
+
+    def store(self, hash, depth, score, bound, move):
+        """Store a search result, move being a move number or 0."""
+        i = 2 * (hash % self.buckets)
+        if (depth < self.depths[i] and self.hashes[i] != hash
+                and self.ages[i] == self.age):
+            i += 1
+        self.hashes[i] = hash
+        self.scores[i] = score
+        self.moves[i] = move
+        self.depths[i] = depth
+        self.bounds[i] = bound
+        self.ages[i] = self.age
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """A transposition table in shared memory which several processes use at
+    once without locks.
+
+    Every entry is packed into three 64-bit words: a check word, the score
+    and the move, depth, bound and age. The check word is the hash XOR the
+    other two, so entries torn by simultaneous writes fail the check and
+    count as missing. The current age is kept in a last word after the
+    entries.
+    """
+    entry_size = 24
+
+    def __init__(self, size, name=None):
+        """Create a table of a given size in megabytes, or attach to the table
+        another process created under a given name.
+        """
+        self.buckets = max(1, size * 2 ** 20 // (2 * self.entry_size))
+        if name is None:
+            self.memory = SharedMemory(
+                create=True, size=2 * self.buckets * self.entry_size + 8)
+            self.clear()
         else:
-            return stalemate_rule * 20000, None
-    score = -25000
-    for move in moves:
-        subscore = -alpha_beta(move, depth - 1, -beta, -alpha)[0]
-        if subscore > score:
-            score = subscore
-            best_moves = [move]
-            if score > alpha:
-                alpha = score
-                if alpha >= beta:
-                    killer_moves[depth - 1] = best_move.notation
-                    break
-        elif subscore == score:
-            best_moves.append(move)
-    return score, choice(best_moves)
+            self.memory = SharedMemory(name)
+        self.owner = name is None
+        self.words = self.memory.buf.cast("Q")
+
+    def clear(self):
+        """Remove all entries."""
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+
+    def close(self):
+        """Detach from the shared memory and free it if this process created
+        it.
+        """
+        self.words.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def probe(self, hash):
+        """Return the depth, score, bound and move number stored for a hash
+        or None.
+        """
+        words = self.words
+        i = 6 * (hash % self.buckets)
+        for i in i, i + 3:
+            check, score, data = words[i], words[i + 1], words[i + 2]
+            if check ^ score ^ data == hash:
+                depth = data >> 32 & 255
+                if depth > 127:
+                    depth -= 256
+                score = unpack("d", pack("Q", score))[0]
+                return depth, score, data >> 40 & 255, data & 0xFFFFFFFF
+        return None
+
+    def new_search(self):
+        """Age the entries stored so far, so that deep results of earlier
+        searches give way to the next one.
+        """
+        words = self.words
+        words[-1] = (words[-1] + 1) % 256
+
+    def store(self, hash, depth, score, bound, move):
+        """Store a search result, move being a move number or 0."""
+        words = self.words
+        age = words[-1]
+        i = 6 * (hash % self.buckets)
+        if (depth < words[i + 2] >> 32 & 255
+                and words[i] ^ words[i + 1] ^ words[i + 2] != hash
+                and words[i + 2] >> 48 == age):
+            i += 3
+        score = unpack("Q", pack("d", score))[0]
+        data = move | (depth & 255) << 32 | bound << 40 | age << 48
+        words[i + 1] = score
+        words[i + 2] = data
+        words[i] = hash ^ score ^ data
+
+
+class Limits:
+    """When a search should stop. None means no limit."""
+
+    def __init__(self, depth=None, nodes=None, time=None, soft_time=None):
+        """Create search limits.
+
+        Parameters:
+        depth -- The deepest iteration to search.
+        nodes -- The number of nodes to search.
+        time -- Time in seconds, after which the search is stopped.
+        soft_time -- Time in seconds, after which no new iteration is started
+        (default: half the time).
+        """
+        self.depth = depth
+        self.nodes = nodes
+        self.soft_time = soft_time
+        self.time = time
+
 
+class Result:
+    """The outcome of a search."""
 
-def iterative_deepening(position):
-    """Analyze a position with increasing depth.
+    def __init__(self, move, score, depth, nodes, completed=None):
+        """Create a search result.
 
-    Returns None but overwrites global score and best_move.
+        Parameters:
+        move -- The best move or None.
+        score -- Its score from the moving player's point of view.
+        depth -- The depth of the iteration which found the move.
+        nodes -- The number of nodes searched.
+        completed -- The depth of the deepest completed iteration (default
+        depth, less for a move from an interrupted iteration).
+        """
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        if completed is None:
+            completed = depth
+        self.completed = completed
+
+
+class Book:
+    """An opening book written by build_book: pairs of 64-bit words, a
+    position hash and a move number, sorted by hash. The file is memory-mapped
+    and searched by bisection, so it is never read as a whole.
+    """
+
+    def __init__(self, path):
+        """Open the book file at a given path."""
+        self.file = open(path, "rb")
+        self.map = None
+        self.words = ()
+        # an empty file cannot be mapped, but is an empty book all the same
+        if getsize(path) > 0:
+            self.map = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+            self.words = memoryview(self.map).cast("Q")
+        self.size = len(self.words) // 2
+
+    def close(self):
+        """Close the book file."""
+        if self.map is not None:
+            self.words.release()
+            self.map.close()
+        self.file.close()
+
+    def probe(self, position):
+        """Return the book move for a position or None.
+
+        The position's hash must be up to date, see Position.find_hash.
+        """
+        words = self.words
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if words[2 * middle] < position.hash:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.size and words[2 * low] == position.hash:
+            number = words[2 * low + 1]
+            for move in position.generate_legal_moves():
+                if move.number() == number:
+                    return move
+        return None
+
+
+class Engine:
+    """A computer player. Every engine owns its search tables and counters, so
+    several engines can search at the same time.
     """
-    try:
-        global best_move, killer_moves, nodes, score
-        print("depth   nodes   score   move")
-        depth = 1
-        killer_moves = []
-        while True:
-            killer_moves = [None] + killer_moves
-            nodes = 0
-            score, best_move = alpha_beta(position, depth)
-            print("%7d %7d %7d %s" % (depth, nodes, score, best_move.notation))
-            if abs(score) == 20000:
+
+    def __init__(self, stalemate=DRAW, table_size=16, verbose=False,
+                 processes=1, lazy=False, book=None):
+        """Create an engine.
+
+        Parameters:
+        stalemate -- WIN, DRAW or LOSS for the stalemated player (default
+        DRAW).
+        table_size -- Size of the transposition table in megabytes (default
+        16).
+        verbose -- Print the result of every iteration (default False).
+        processes -- The number of worker processes searching root moves in
+        parallel or 1 to search in this process only (default 1).
+        lazy -- Instead of sharing out root moves, let this process and
+        processes - 1 helpers search the whole tree at slightly different
+        depths, sharing a transposition table (Lazy SMP, default False).
+        book -- The path of an opening book file or None (default None).
+        """
+        self.book = None if book is None else Book(book)
+        self.counter_moves = {}
+        self.history = {}
+        self.kept_tables = False
+        self.killer_moves = []
+        self.lazy = lazy and processes > 1
+        self.limits = Limits()
+        self.next_poll = 0
+        self.nodes = 0
+        self.partial = None
+        self.ponder_result = None
+        self.ponder_thread = None
+        self.ponder_verbose = verbose
+        self.pool = None
+        self.processes = processes
+        self.pv = {}
+        self.searches = 0  # see search_root_move
+        self.shared_alpha = None
+        self.shared_stop = None
+        self.stalemate_rule = stalemate
+        self.start = monotonic()
+        self.stopped = False
+        if self.lazy:
+            self.table = SharedTranspositionTable(table_size)
+        else:
+            self.table = TranspositionTable(table_size)
+        self.verbose = verbose
+        if self.lazy:
+            # the table and the stop flag live in shared memory
+            self.shared_stop = Value("b", False, lock=False)
+            self.pool = ProcessPoolExecutor(
+                processes - 1, initializer=start_worker,
+                initargs=(stalemate, table_size, None, self.shared_stop,
+                          self.table.memory.name))
+        elif processes > 1:
+            # the best root score and the stop flag live in shared memory
+            self.shared_alpha = Value("d", -20000)
+            self.shared_stop = Value("b", False, lock=False)
+            self.pool = ProcessPoolExecutor(
+                processes, initializer=start_worker,
+                initargs=(stalemate, table_size, self.shared_alpha,
+                          self.shared_stop))
+
+    def alpha_beta(self, position, depth, alpha=-20000, beta=20000, ply=0,
+                   previous=0):
+        """Perform an alpha-beta search on a position.
+
+        Moves are made and taken back in place, so the position is left
+        unchanged unless the search is interrupted.
+
+        Parameters:
+        position -- A position.
+        depth -- The search depth.
+        alpha -- The lower limit of the alpha-beta window.
+        beta -- The upper limit of the alpha-beta window.
+        ply -- The distance from the root.
+        previous -- The number of the move leading to the position or 0.
+        """
+        if depth == 0:
+            return self.quiescence(position, alpha, beta), None
+        self.nodes += 1
+        if self.nodes >= self.next_poll:
+            self.poll()
+        # transposition table cutoff, except at the root which must return a
+        # move
+        hash_move = 0
+        entry = self.table.probe(position.hash)
+        if entry is not None:
+            entry_depth, entry_score, bound, hash_move = entry
+            if ply > 0 and entry_depth >= depth and (
+                    bound == EXACT or bound == LOWER and entry_score >= beta
+                    or bound == UPPER and entry_score <= alpha):
+                return entry_score, None
+        if not hash_move:
+            hash_move = self.pv.get(position.hash, 0)
+        # null moves and reductions are only tried away from the horizon and
+        # out of check
+        selective = depth > 2 and not position.check(position.player)
+        # null move pruning: if passing the turn still fails high, some move
+        # will, unless the position is zugzwang-prone
+        reduction = position.null_move_reduction
+        if (selective and reduction and previous and beta < 20000
+                and position.evaluate() >= beta and not position.zugzwang()):
+            subscore = -self.alpha_beta(position.null_move(),
+                                        depth - 1 - reduction, -beta,
+                                        -beta + 1, ply + 1)[0]
+            if subscore >= beta:
+                return beta, None
+        original_alpha = alpha
+        score = -25000
+        best_moves = []
+        searched = 0
+        # most nodes are cut off after a move or two, so only analyse pins and
+        # checks once the first move has been searched
+        pins = None
+        killers = self.killer_moves[ply]
+        counter = self.counter_moves.get(previous, 0)
+        for move in self.pick_moves(position, hash_move, killers, counter):
+            legal = None
+            quiet = (position.empty(move.target) and move.victim is None
+                     and move.promotion is None)
+            if best_moves:
+                if pins is None:
+                    pins = position.pins() or False
+                if pins:
+                    legal = position.certify(move, pins)
+                    if legal is False:
+                        continue
+            undo = position.do_move(move)
+            if legal is None and not position.legal():
+                position.undo_move(move, undo)
+                continue
+            number = move.number()
+            if best_moves:
+                # late move reductions: search quiet moves late in the order
+                # less deeply, and again at full depth if they turn out better
+                reduction = 0
+                if selective and quiet and searched >= LATE_MOVES:
+                    reduction = position.late_move_reduction
+                # principal variation search: test the move with a null window
+                # and only search it again if it turns out better
+                subscore = -self.alpha_beta(position, depth - 1 - reduction,
+                                            -alpha - 1, -alpha, ply + 1,
+                                            number)[0]
+                if reduction and subscore > alpha:
+                    subscore = -self.alpha_beta(position, depth - 1,
+                                                -alpha - 1, -alpha, ply + 1,
+                                                number)[0]
+                # a score outside its window is only a bound, never a tie
+                exact = False
+                if alpha < subscore < beta:
+                    subscore = -self.alpha_beta(position, depth - 1, -beta,
+                                                -alpha, ply + 1, number)[0]
+                    exact = alpha < subscore < beta
+            else:
+                subscore = -self.alpha_beta(position, depth - 1, -beta,
+                                            -alpha, ply + 1, number)[0]
+                exact = alpha < subscore < beta
+            position.undo_move(move, undo)
+            searched += 1
+            if subscore > score:
+                score = subscore
+                best_moves = [move]
+                if score > alpha:
+                    alpha = score
+                    if ply == 0:
+                        # an interrupted iteration can still play this move
+                        self.partial = Result(move, score, depth, self.nodes,
+                                              depth - 1)
+                    if alpha >= beta:
+                        # remember quiet moves that cause cutoffs
+                        if quiet:
+                            if killers[0] != number:
+                                killers[1] = killers[0]
+                                killers[0] = number
+                            self.history[number] = (
+                                self.history.get(number, 0) + depth ** 2)
+                            self.counter_moves[previous] = number
+                        break
+            elif subscore == score and exact:
+                best_moves.append(move)
+        if len(best_moves) == 0:
+            if position.check(position.player):
+                score = -20000
+            else:
+                score = self.stalemate_rule * 20000
+            self.table.store(position.hash, depth, score, EXACT, 0)
+            return score, None
+        move = choice(best_moves)
+        if score <= original_alpha:
+            bound = UPPER
+        elif score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(position.hash, depth, score, bound, move.number())
+        return score, move
+
+    def close(self):
+        """Shut down the worker processes, if any, free the transposition
+        table and close the opening book.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        self.table.close()
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+
+    def deepen(self, position, depth):
+        """Search a position with increasing depth, from a given depth until
+        the limits are reached or the search is stopped.
+
+        Returns a Result for the deepest completed iteration, or for the best
+        move of an interrupted iteration if one was found.
+
+        Parameters:
+        position -- A position, left with moves made if stopped.
+        depth -- The depth of the first iteration.
+        """
+        if self.pool is None or self.lazy:
+            search = self.alpha_beta
+        else:
+            search = self.split
+        result = Result(None, 0, 0, self.nodes)
+        stable = 0
+        try:
+            # the limits may change while pondering
+            while self.limits.depth is None or depth <= self.limits.depth:
+                while len(self.killer_moves) < depth:
+                    self.killer_moves.append([0, 0])
+                self.partial = None
+                # search a window around the previous score, widening it on
+                # failure
+                window = ASPIRATION_WINDOW
+                if result.move is None:
+                    alpha, beta = -20000, 20000
+                else:
+                    alpha = max(result.score - window, -20000)
+                    beta = min(result.score + window, 20000)
+                while True:
+                    score, move = search(position, depth, alpha, beta)
+                    window *= 2
+                    if score <= alpha and alpha > -20000:
+                        alpha = max(score - window, -20000)
+                    elif score >= beta and beta < 20000:
+                        beta = min(score + window, 20000)
+                    else:
+                        break
+                if result.move is not None and move == result.move:
+                    stable += 1
+                else:
+                    stable = 0
+                result = Result(move, score, depth, self.nodes)
+                if self.verbose:
+                    print("%7d %7d %7d %s" % (depth, self.nodes, score,
+                                              position.notation(move)))
+                if abs(score) == 20000:
+                    break
+                # the next iteration would hardly finish in time, and is
+                # unlikely to change a best move that has held for a while
+                limits = self.limits
+                soft_time = limits.soft_time
+                if soft_time is None and limits.time is not None:
+                    soft_time = limits.time * SOFT_TIME
+                if soft_time is not None:
+                    elapsed = monotonic() - self.start
+                    if elapsed >= soft_time or (
+                            stable >= STABLE_ITERATIONS
+                            and elapsed >= soft_time / 2):
+                        break
+                depth += 1
+        except TimeoutError:
+            if self.partial is not None:
+                result = self.partial
+                if self.verbose:
+                    print("%7d %7d %7d %s" % (result.depth, self.nodes,
+                                              result.score,
+                                              position.notation(result.move)))
+        return result
+
+    def end_ponder(self, limits=None):
+        """Finish pondering and return the Result of the background search.
+
+        Parameters:
+        limits -- Limits for the rest of the search, counted from now, if
+        the expected move was played, or None to stop at once.
+        """
+        if self.ponder_thread is not None:
+            if limits is None:
+                self.stop()
+            else:
+                self.limits = limits
+                self.start = monotonic()
+                self.verbose = self.ponder_verbose
+                if self.verbose:
+                    print("depth   nodes   score   move")
+            self.ponder_thread.join()
+            self.ponder_thread = None
+        self.verbose = self.ponder_verbose
+        result = self.ponder_result
+        self.ponder_result = None
+        return result
+
+    def new_search(self, keep_tables):
+        """Clear the tables for a new search, or only age them if keep_tables
+        is True.
+        """
+        self.kept_tables = keep_tables
+        self.searches += 1
+        if keep_tables:
+            self.history = {
+                number: value // 2 for number, value in self.history.items()
+            }
+            self.table.new_search()
+        else:
+            self.counter_moves = {}
+            self.history = {}
+            self.killer_moves = []
+            self.pv = {}
+            self.table.clear()
+
+    def pick_moves(self, position, hash_move, killers, counter):
+        """Generate pseudo-legal moves in the order alpha_beta should search
+        them: the hash move, captures and promotions by the values of the
+        pieces won and lost, the killer moves, the counter move and the
+        remaining quiet moves by history.
+
+        The hash move comes from the moves of a single piece, everything else
+        is only generated if the hash move does not produce a cutoff.
+
+        Parameters:
+        position -- A position.
+        hash_move -- The number of the transposition table's move or 0.
+        killers -- The numbers of the killer moves or 0.
+        counter -- The number of the counter move or 0.
+        """
+        board = position.board
+        first = None
+        if hash_move:
+            origin = hash_move & 1023  # see Move.number
+            if board[origin].player == position.player:
+                for move in board[origin].generate_moves(position, origin):
+                    if move.number() == hash_move:
+                        first = move
+                        yield move
+                        break
+        captures = []
+        quiets = []
+        for move in position.generate_moves():
+            if move == first:
+                continue
+            if (board[move.target].player == -position.player
+                    or move.victim is not None or move.promotion is not None):
+                captures.append(move)
+            else:
+                quiets.append(move)
+        captures.sort(key=lambda move: gain(position, move), reverse=True)
+        yield from captures
+        numbers = [move.number() for move in quiets]
+        for number in killers[0], killers[1], counter:
+            if number in numbers:
+                i = numbers.index(number)
+                del numbers[i]
+                yield quiets.pop(i)
+        history = self.history
+        order = sorted(range(len(quiets)),
+                       key=lambda i: history.get(numbers[i], 0), reverse=True)
+        for i in order:
+            yield quiets[i]
+
+    def poll(self):
+        """Check the limits and the stop flag, raising TimeoutError if the
+        search must stop. Called every POLL_NODES nodes.
+        """
+        limits = self.limits
+        self.next_poll = self.nodes + POLL_NODES
+        if limits.nodes is not None:
+            self.next_poll = min(self.next_poll, limits.nodes)
+        if self.stopped or self.shared_stop is not None and (
+                self.shared_stop.value):
+            raise TimeoutError()
+        if (limits.nodes is not None and self.nodes >= limits.nodes
+                or limits.time is not None
+                and monotonic() - self.start >= limits.time):
+            self.stop()
+            raise TimeoutError()
+
+    def ponder(self, position):
+        """Search a position in a background thread, quietly and without
+        limits, until end_ponder is called. The search starts from the tables
+        of the previous one.
+
+        Parameters:
+        position -- A position, usually after the expected move of the
+        opponent.
+        """
+        self.ponder_result = None
+        self.ponder_verbose = self.verbose
+        self.verbose = False
+        position = type(position)(copy=position)
+        position.find_hash()
+        if self.book is not None:
+            move = self.book.probe(position)
+            if move is not None:
+                self.ponder_result = Result(move, 0, 0, 0)
                 return
-            depth += 1
-    except TimeoutError:
-        return
+        # set up here, so that end_ponder cannot come before the search has
+        # taken its limits and stop flag
+        moves = self.prepare_search(position, None, True)
+        self.ponder_thread = Thread(target=self.ponder_search,
+                                    args=(position, moves), daemon=True)
+        self.ponder_thread.start()
+
+    def ponder_search(self, position, moves):
+        """Run the background search of ponder."""
+        self.ponder_result = self.run_search(position, moves)
+
+    def prepare_search(self, position, limits, keep_tables):
+        """Set up the limits, the clock, the stop flag and the tables for a
+        search of a position, see search.
+
+        Returns the legal moves of the position.
+        """
+        self.start = monotonic()
+        if limits is None:
+            limits = Limits()
+        moves = position.generate_legal_moves()
+        if len(moves) == 1:
+            limits = Limits(1, limits.nodes, limits.time, limits.soft_time)
+        self.limits = limits
+        self.next_poll = 0
+        self.new_search(keep_tables)
+        self.nodes = 0
+        self.stopped = False
+        if self.pool is not None:
+            self.shared_stop.value = False
+        return moves
+
+    def quiescence(self, position, alpha, beta, depth=QUIESCENCE_DEPTH):
+        """Search only captures and promotions, so that alpha_beta does not
+        evaluate positions in the middle of an exchange.
 
+        The side to move may stand pat on the static evaluation. Captures that
+        cannot raise the score to alpha even with a safety margin are skipped.
 
-def play(position, time_limit, white=HUMAN, black=COMPUTER, stalemate=DRAW):
+        Parameters:
+        position -- A position.
+        alpha -- The lower limit of the alpha-beta window.
+        beta -- The upper limit of the alpha-beta window.
+        depth -- The maximum number of further captures.
+        """
+        self.nodes += 1
+        if self.nodes >= self.next_poll:
+            self.poll()
+        score = stand_pat = position.evaluate()
+        if score >= beta or depth == 0:
+            return score
+        if score > alpha:
+            alpha = score
+        board = position.board
+        attacks = position.attack_map(-position.player)
+        moves = position.generate_captures()
+        moves.sort(key=lambda move: gain(position, move), reverse=True)
+        for move in moves:
+            value = gain(position, move)
+            # skip captures that lose material to a recapture
+            if value < 0 and attacks[move.target]:
+                continue
+            # delta pruning, failing soft no lower than the capture might score
+            value += stand_pat + board[move.origin].value + DELTA_MARGIN
+            if value <= alpha:
+                score = max(score, value)
+                continue
+            undo = position.do_move(move)
+            if not position.legal():
+                position.undo_move(move, undo)
+                continue
+            subscore = -self.quiescence(position, -beta, -alpha, depth - 1)
+            position.undo_move(move, undo)
+            if subscore > score:
+                score = subscore
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return score
+
+    def run_search(self, position, moves):
+        """Search a position set up by prepare_search, see search.
+
+        Parameters:
+        position -- A position, left unchanged.
+        moves -- Its legal moves.
+        """
+        helpers = []
+        if self.lazy:
+            # helpers start one iteration ahead or level with this process
+            for i in range(self.processes - 1):
+                helpers.append(self.pool.submit(help_search, position,
+                                                1 + (i + 1) % 2,
+                                                self.limits.depth))
+        # search a copy, an interrupted search leaves moves made
+        root = type(position)(copy=position)
+        result = self.deepen(root, 1)
+        if result.move is None and moves:
+            # stopped before the first iteration finished
+            result.move = moves[0]
+        if helpers:
+            # report a helper's result if it got deeper
+            self.shared_stop.value = True
+            deepest = result
+            for future in helpers:
+                depth, score, number, nodes = future.result()
+                self.nodes += nodes
+                if depth > deepest.completed:
+                    for move in position.generate_moves():
+                        if move.number() == number:
+                            deepest = Result(move, score, depth, 0)
+            if deepest is not result and self.verbose:
+                print("%7d %7d %7d %s" % (deepest.depth, self.nodes,
+                                          deepest.score,
+                                          position.notation(deepest.move)))
+            result = deepest
+        # remember the principal variation for the next search, in case the
+        # table loses it
+        self.pv = {}
+        root = type(position)(copy=position)
+        move = result.move
+        while move is not None and root.hash not in self.pv:
+            self.pv[root.hash] = move.number()
+            root.do_move(move)
+            entry = self.table.probe(root.hash)
+            move = None
+            if entry is not None and entry[3]:
+                for candidate in root.generate_moves():
+                    if candidate.number() == entry[3]:
+                        move = candidate
+        result.nodes = self.nodes
+        return result
+
+    def search(self, position, limits=None, keep_tables=False):
+        """Analyze a position with increasing depth until a limit is reached or
+        stop is called.
+
+        Returns a Result for the deepest completed iteration, or for a better
+        move found by the interrupted one. A forced move is only searched to
+        depth 1, and a move from the opening book not at all.
+
+        Parameters:
+        position -- A position, left unchanged.
+        limits -- Limits or None for an unlimited search.
+        keep_tables -- Whether to start from the transposition table, move
+        ordering tables and principal variation of the previous search, aged
+        rather than cleared, as within a game (default False).
+        """
+        # castling rights and the like may have been set up without updating
+        # the hash, which the book and the tables rely on
+        position = type(position)(copy=position)
+        position.find_hash()
+        if self.book is not None:
+            move = self.book.probe(position)
+            if move is not None:
+                if self.verbose:
+                    print("book move %s" % position.notation(move))
+                return Result(move, 0, 0, 0)
+        moves = self.prepare_search(position, limits, keep_tables)
+        if self.verbose:
+            print("depth   nodes   score   move")
+        return self.run_search(position, moves)
+
+    def split(self, position, depth, alpha=-20000, beta=20000):
+        """Search a position like alpha_beta at the root, but share the root
+        moves out to the worker processes.
+
+        The first move is searched here. Once its score is known, the other
+        moves go to the workers, which start from the best score found so
+        far (young brothers wait).
+        """
+        self.nodes += 1
+        if self.nodes >= self.next_poll:
+            self.poll()
+        entry = self.table.probe(position.hash)
+        hash_move = 0 if entry is None else entry[3]
+        if not hash_move:
+            hash_move = self.pv.get(position.hash, 0)
+        moves = []
+        for move in self.pick_moves(position, hash_move,
+                                    self.killer_moves[0], 0):
+            undo = position.do_move(move)
+            if position.legal():
+                moves.append(move)
+            position.undo_move(move, undo)
+        # too little work to share
+        if len(moves) < 2 or depth < 2:
+            return self.alpha_beta(position, depth, alpha, beta)
+        original_alpha = alpha
+        undo = position.do_move(moves[0])
+        score = -self.alpha_beta(position, depth - 1, -beta, -alpha, 1,
+                                 moves[0].number())[0]
+        position.undo_move(moves[0], undo)
+        best_moves = [moves[0]]
+        if score > alpha:
+            self.partial = Result(moves[0], score, depth, self.nodes,
+                                  depth - 1)
+        if score < beta:
+            self.shared_alpha.value = max(alpha, score)
+            futures = [
+                self.pool.submit(search_root_move, position, move.number(),
+                                 depth, beta, self.searches,
+                                 self.kept_tables)
+                for move in moves[1:]
+            ]
+            try:
+                for move, future in zip(moves[1:], futures):
+                    # keep an eye on the clock while the workers search
+                    while wait([future], 0.01).not_done:
+                        self.poll()
+                    subscore, nodes, exact = future.result()
+                    self.nodes += nodes
+                    self.poll()
+                    if subscore is None:
+                        continue
+                    if subscore > score:
+                        score = subscore
+                        best_moves = [move]
+                        if score > original_alpha:
+                            self.partial = Result(move, score, depth,
+                                                  self.nodes, depth - 1)
+                    elif subscore == score and exact:
+                        best_moves.append(move)
+            finally:
+                # moves still queued would hold up the next search
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+        move = choice(best_moves)
+        if score <= original_alpha:
+            bound = UPPER
+        elif score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(position.hash, depth, score, bound, move.number())
+        return score, move
+
+    def stop(self):
+        """Make a running search return as soon as possible."""
+        self.stopped = True
+        if self.shared_stop is not None:
+            self.shared_stop.value = True
+
+
+def build_book(position, path, plies, limits, stalemate=DRAW):
+    """Search the openings of a variant and write the best moves to an opening
+    book file, see Book.
+
+    The engine may play either side and the opponent any move, so the book
+    holds a move for every position where the engine follows the book and the
+    opponent moves freely during the first plies.
+
+    Returns the number of positions in the book.
+
+    Parameters:
+    position -- The setup position.
+    path -- The path of the book file.
+    plies -- The number of plies covered.
+    limits -- Limits for the search of every position.
+    stalemate -- WIN, DRAW or LOSS for the stalemated player (default DRAW).
+    """
+    engine = Engine(stalemate)
+    position = type(position)(copy=position)
+    position.find_hash()
+    book = {}
+    for player in WHITE, BLACK:
+        frontier = {position.hash: position}
+        for ply in range(plies):
+            children = {}
+            for node in frontier.values():
+                if node.player == player:
+                    if node.hash not in book:
+                        book[node.hash] = engine.search(node, limits).move
+                    moves = [book[node.hash]]
+                else:
+                    moves = node.generate_legal_moves()
+                for move in moves:
+                    if move is not None:
+                        child = node.make_move(move)
+                        children[child.hash] = child
+            frontier = children
+    engine.close()
+    words = array("Q")
+    for hash in sorted(book):
+        if book[hash] is not None:
+            words.extend((hash, book[hash].number()))
+    with open(path, "wb") as file:
+        words.tofile(file)
+    return len(words) // 2
+
+
+def gain(position, move):
+    """Return the value of the captured piece minus the value of the capturing
+    piece, plus the value of any promotion (MVV-LVA).
+    """
+    board = position.board
+    if move.victim is None:
+        value = board[move.target].value
+    else:
+        value = board[move.victim].value
+    value -= board[move.origin].value
+    if move.promotion is not None:
+        value += move.promotion.value
+    return value
+
+
+def help_search(position, depth, limit):
+    """Search a position in a helper process of Lazy SMP, see Engine.search.
+
+    Returns the depth of the deepest completed iteration, the score and
+    number of the best move found and the number of nodes searched.
+
+    Parameters:
+    position -- A position.
+    depth -- The depth of the first iteration.
+    limit -- The depth of the last iteration or None.
+    """
+    worker.counter_moves = {}
+    worker.history = {}
+    worker.killer_moves = []
+    worker.limits = Limits(limit)
+    worker.next_poll = 0
+    worker.nodes = 0
+    result = worker.deepen(position, depth)
+    number = 0 if result.move is None else result.move.number()
+    # only a completed iteration may count against the main process's
+    return result.completed, result.score, number, worker.nodes
+
+
+def play(position, time_limit, white=HUMAN, black=COMPUTER, stalemate=DRAW,
+         table_size=16, processes=1, book=None):
     """Play a game of chess.
 
     Parameters:
@@ -755,16 +2547,36 @@ def play(position, time_limit, white=HUMAN, black=COMPUTER, stalemate=DRAW):
     time_limit -- Time limit per move in seconds.
     white -- HUMAN or COMPUTER (default HUMAN).
     black -- HUMAN or COMPUTER (default COMPUTER).
+    table_size -- Size of the transposition table in megabytes (default 16).
+    processes -- The number of processes searching in parallel (default 1).
+    book -- The path of an opening book file, used if it exists (default
+    None).
     """
-    global stalemate_rule, stop
     players = {WHITE: white, BLACK: black}
-    stalemate_rule = stalemate
+    if book is not None and not exists(book):
+        book = None
+    engine = Engine(stalemate, table_size, verbose=True, processes=processes,
+                    book=book)
     count = 1
+    result = None
+    # castling rights and the like are set up without updating the hash
+    position.find_hash()
     print(position)
     while not position.game_over():
         # human move
         if players[position.player] == HUMAN:
             moves = position.generate_legal_moves()
+            expected = None
+            if COMPUTER in players.values():
+                # ponder on the human's time, on the expected move if the
+                # principal variation has one and on all moves otherwise
+                number = engine.pv.get(position.hash)
+                pondered = type(position)(copy=position)
+                for move in moves:
+                    if move.number() == number:
+                        expected = move
+                        pondered = position.make_move(move)
+                engine.ponder(pondered)
             legal = False
             while True:
                 if position.player == WHITE:
@@ -772,35 +2584,109 @@ def play(position, time_limit, white=HUMAN, black=COMPUTER, stalemate=DRAW):
                 else:
                     notation = input("%d... " % count)
                 for move in moves:
-                    if move.notation == notation:
+                    if position.notation(move) == notation:
                         legal = True
-                        position = move
+                        position = position.make_move(move)
                         break
                 if legal:
                     break
+            if expected is not None and move == expected:
+                # the search is already under way
+                print()
+                result = engine.end_ponder(Limits(time=time_limit))
+            else:
+                # the table is warm at least
+                engine.end_ponder()
         # computer move
         elif players[position.player] == COMPUTER:
-            stop = False
-            thread = Thread(target=iterative_deepening, args=(position,),
-                            daemon=True)
-            thread.start()
-            thread.join(time_limit)
-            stop = True
+            if result is None:
+                # the tables of earlier moves still hold much of this search
+                result = engine.search(position, Limits(time=time_limit),
+                                       keep_tables=True)
+            move = result.move
+            result = None
             print()
             if position.player == WHITE:
-                print("%d. %s" % (count, best_move.notation))
+                print("%d. %s" % (count, position.notation(move)))
             else:
-                print("%d... %s" % (count, best_move.notation))
-            position = best_move
+                print("%d... %s" % (count, position.notation(move)))
+            position = position.make_move(move)
         # random move
         elif players[position.player] == RANDOM:
             move = choice(position.generate_legal_moves())
             if position.player == WHITE:
-                print("%d. %s" % (count, move.notation))
+                print("%d. %s" % (count, position.notation(move)))
             else:
-                print("%d... %s" % (count, move.notation))
-            position = move
+                print("%d... %s" % (count, position.notation(move)))
+            position = position.make_move(move)
         print()
         print(position)
         if position.player == WHITE:
             count += 1
+    engine.close()
+
+
+def search_root_move(position, number, depth, beta, searches, keep_tables):
+    """Search a root move in a worker process, see Engine.split.
+
+    Returns the move's score, or None if another move has already failed
+    high, the number of nodes searched and whether the score is exact rather
+    than a bound.
+
+    Parameters:
+    position -- The root position.
+    number -- The number of the move.
+    depth -- The depth of the root.
+    beta -- The upper limit of the root's alpha-beta window.
+    searches -- The number of searches the main engine has started.
+    keep_tables -- Whether the main engine kept its tables for this search.
+    """
+    if worker.searches != searches:
+        # the first root move of a new search here, prepare the tables like
+        # the main engine did
+        worker.new_search(keep_tables)
+        worker.searches = searches
+    alpha = worker.shared_alpha.value
+    if alpha >= beta:
+        return None, 0, False
+    if worker.shared_stop.value:
+        raise TimeoutError()
+    worker.killer_moves = [[0, 0] for ply in range(depth)]
+    worker.next_poll = 0
+    worker.nodes = 0
+    for move in position.generate_moves():
+        if move.number() == number:
+            break
+    position.do_move(move)
+    # null window first, the move rarely beats the best one so far
+    score = -worker.alpha_beta(position, depth - 1, -alpha - 1, -alpha, 1,
+                               number)[0]
+    exact = False
+    if alpha < score < beta:
+        score = -worker.alpha_beta(position, depth - 1, -beta, -alpha, 1,
+                                   number)[0]
+        exact = alpha < score < beta
+    with worker.shared_alpha.get_lock():
+        if score > worker.shared_alpha.value:
+            worker.shared_alpha.value = score
+    return score, worker.nodes, exact
+
+
+def start_worker(stalemate, table_size, alpha, stop, table=None):
+    """Create the engine of a worker process, see Engine.split and
+    help_search.
+
+    Parameters:
+    stalemate -- WIN, DRAW or LOSS for the stalemated player.
+    table_size -- Size of the transposition table in megabytes.
+    alpha -- The shared best root score or None.
+    stop -- The shared stop flag.
+    table -- The name of a shared transposition table or None.
+    """
+    global worker
+    worker = Engine(stalemate, table_size)
+    if table is not None:
+        worker.table.close()
+        worker.table = SharedTranspositionTable(table_size, table)
+    worker.shared_alpha = alpha
+    worker.shared_stop = stop